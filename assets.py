@@ -0,0 +1,116 @@
+from collections import OrderedDict
+
+import pygame
+
+from tracing import tracer
+
+class AssetRegistry(object):
+  """Process wide cache of image surfaces, fonts and rendered text. Each image
+  is loaded and converted once and the surface shared between every object
+  using it, along with any variants derived from it, such as flipped or
+  scaled versions. Surfaces handed out are shared so must not be drawn on"""
+
+  # Most rendered text surfaces to keep, least recently used are dropped
+  TEXT_CACHE_SIZE = 256
+
+  def __init__(self, directory='images'):
+    self.directory = directory
+    # (image_path, flip_x, size, alpha) -> surface
+    self.images = {}
+    self.hits = 0
+    self.misses = 0
+
+    # (font_path, size) -> font
+    self.fonts = {}
+    # (font_path, size, text, colour) -> surface, oldest use first
+    self.texts = OrderedDict()
+    self.text_hits = 0
+    self.text_misses = 0
+
+  def load_image(self, image_path, alpha):
+    """Load an image from disk, converting it to the display's format"""
+    start = tracer.now()
+    surface = pygame.image.load('{}/{}'.format(self.directory, image_path))
+    surface = surface.convert_alpha() if alpha else surface.convert()
+    tracer.complete('load_image', start, category='assets',
+      args={'path': image_path})
+    return surface
+
+  def get_image(self, image_path, flip_x=False, size=None, alpha=True):
+    """Return the surface for an image, optionally flipped horizontally and/or
+    scaled to size. alpha keeps per pixel transparency, otherwise the image
+    is converted to an opaque surface, which is quicker to blit"""
+    key = (image_path, flip_x, size, alpha)
+    surface = self.images.get(key)
+    if surface is not None:
+      self.hits += 1
+      return surface
+
+    self.misses += 1
+    if size:
+      # Scale the (possibly flipped) image
+      base = self.get_image(image_path, flip_x, alpha=alpha)
+      surface = pygame.transform.smoothscale(base, size) \
+        if base.get_bitsize() in (24, 32) else pygame.transform.scale(base, size)
+    elif flip_x:
+      base = self.get_image(image_path, alpha=alpha)
+      surface = pygame.transform.flip(base, True, False)
+    else:
+      surface = self.load_image(image_path, alpha)
+
+    self.images[key] = surface
+    return surface
+
+  def get_font(self, font_path, size):
+    """Return the font for a font file at a size, loaded once"""
+    key = (font_path, size)
+    if key not in self.fonts:
+      start = tracer.now()
+      self.fonts[key] = pygame.font.Font(font_path, size)
+      tracer.complete('load_font', start, category='assets',
+        args={'path': font_path, 'size': size})
+    return self.fonts[key]
+
+  def render_text(self, font_path, size, text, colour):
+    """Return a surface of antialiased text, rendering it only if it isn't
+    one of the TEXT_CACHE_SIZE most recently used"""
+    key = (font_path, size, text, colour)
+    surface = self.texts.pop(key, None)
+    if surface is not None:
+      self.text_hits += 1
+    else:
+      self.text_misses += 1
+      surface = self.get_font(font_path, size).render(text, True, colour)
+      if len(self.texts) >= self.TEXT_CACHE_SIZE:
+        # Evict the least recently used
+        self.texts.popitem(last=False)
+
+    # (Re)insert as the most recently used
+    self.texts[key] = surface
+    return surface
+
+  def get_stats(self):
+    """Return a dict of cache hits, misses and the number of items held"""
+    return {
+      'hits': self.hits,
+      'misses': self.misses,
+      'images': len(self.images),
+      'fonts': len(self.fonts),
+      'text_hits': self.text_hits,
+      'text_misses': self.text_misses,
+      'texts': len(self.texts),
+    }
+
+  def clear(self):
+    """Drop all cached surfaces and fonts, and their stats, for example after
+    the display mode changes or pygame quits"""
+    self.images = {}
+    self.hits = 0
+    self.misses = 0
+    self.fonts = {}
+    self.texts = OrderedDict()
+    self.text_hits = 0
+    self.text_misses = 0
+
+# The registry shared by the whole game
+registry = AssetRegistry()
@@ -0,0 +1,184 @@
+import wave
+import audioop
+
+import pygame
+
+from tracing import tracer
+
+class StreamingSound(object):
+  """Plays a long WAV file by decoding it a chunk at a time and queueing the
+  chunks on a channel, rather than decoding the whole file into memory.
+  update needs calling regularly to keep the channel fed"""
+
+  CHUNK_SECONDS = 0.5
+
+  def __init__(self, path, channel):
+    self.path = path
+    self.channel = channel
+    self.frequency, self.format, self.channels = pygame.mixer.get_init()
+    self.wav = None
+    self.loops = 0
+    self.rate_state = None
+
+  @classmethod
+  def supported(cls):
+    """Whether the mixer's format is one chunks can be converted to"""
+    init = pygame.mixer.get_init()
+    return init is not None and init[1] == -16 and init[2] in (1, 2)
+
+  def play(self, volume=1.0, loops=0):
+    """Start playing, loops as for pygame.mixer.Sound.play"""
+    self.wav = wave.open(self.path, 'rb')
+    self.loops = loops
+    self.rate_state = None
+    self.channel.set_volume(volume)
+
+    chunk = self.read_chunk()
+    if chunk:
+      self.channel.play(chunk)
+
+  def update(self):
+    """Queue the next chunk if the channel has room for it"""
+    if self.wav and self.channel.get_queue() is None:
+      chunk = self.read_chunk()
+      if chunk:
+        self.channel.queue(chunk)
+
+  def stop(self):
+    self.channel.stop()
+    if self.wav:
+      self.wav.close()
+      self.wav = None
+
+  def read_chunk(self):
+    """Return the next chunk as a Sound, or None once finished"""
+    frames = self.wav.readframes(
+      int(self.wav.getframerate() * self.CHUNK_SECONDS)
+    )
+    if not frames:
+      if self.loops == 0:
+        # Finished, the queued chunks play out
+        self.wav.close()
+        self.wav = None
+        return None
+      if self.loops > 0:
+        self.loops -= 1
+      self.wav.rewind()
+      frames = self.wav.readframes(
+        int(self.wav.getframerate() * self.CHUNK_SECONDS)
+      )
+
+    return pygame.mixer.Sound(buffer=self.convert(frames))
+
+  def convert(self, frames):
+    """Convert raw WAV frames to the mixer's 16 bit format"""
+    width = self.wav.getsampwidth()
+    channels = self.wav.getnchannels()
+    rate = self.wav.getframerate()
+
+    if width == 1:
+      # 8 bit WAVs are unsigned
+      frames = audioop.bias(frames, 1, -128)
+    if width != 2:
+      frames = audioop.lin2lin(frames, width, 2)
+    if rate != self.frequency:
+      frames, self.rate_state = audioop.ratecv(
+        frames, 2, channels, rate, self.frequency, self.rate_state
+      )
+    if channels == 1 and self.channels == 2:
+      frames = audioop.tostereo(frames, 2, 1, 1)
+    elif channels == 2 and self.channels == 1:
+      frames = audioop.tomono(frames, 2, 0.5, 0.5)
+    return frames
+
+
+class SoundBank(object):
+  """Process wide audio. Short sound effects are loaded once and kept, long
+  tracks are streamed, either as the mixer's music or a StreamingSound.
+  Everything is silently skipped when the mixer isn't initialised, such as
+  when running headless"""
+
+  def __init__(self, directory='sounds'):
+    self.directory = directory
+    # File name -> Sound
+    self.sounds = {}
+    self.streams = []
+
+  def get_path(self, name):
+    return '{}/{}'.format(self.directory, name)
+
+  def enabled(self):
+    return pygame.mixer.get_init() is not None
+
+  def get_sound(self, name):
+    """Return the Sound for a short effect, loaded the first time it's asked
+    for, or None if audio is disabled"""
+    if not self.enabled():
+      return None
+    if name not in self.sounds:
+      start = tracer.now()
+      self.sounds[name] = pygame.mixer.Sound(self.get_path(name))
+      tracer.complete('load_sound', start, category='assets',
+        args={'path': name})
+    return self.sounds[name]
+
+  def preload(self, names):
+    """Load short effects ahead of them being played"""
+    for name in names:
+      self.get_sound(name)
+
+  def play(self, name, volume=1.0, loops=0):
+    """Play a short effect"""
+    sound = self.get_sound(name)
+    if sound:
+      sound.set_volume(volume)
+      sound.play(loops)
+
+  def play_music(self, name, volume=1.0, loops=-1):
+    """Stream a long track as the mixer's music, replacing any playing"""
+    if not self.enabled():
+      return
+    pygame.mixer.music.load(self.get_path(name))
+    pygame.mixer.music.set_volume(volume)
+    pygame.mixer.music.play(loops)
+
+  def stream(self, name, volume=1.0, loops=-1):
+    """Stream a long track on its own channel, alongside the music. Falls back
+    to loading the whole track if the mixer's format can't be streamed to"""
+    if not self.enabled():
+      return
+    if not StreamingSound.supported():
+      self.play(name, volume, loops)
+      return
+
+    # Reserve a channel for the stream so effects don't take it over
+    pygame.mixer.set_reserved(len(self.streams) + 1)
+    stream = StreamingSound(
+      self.get_path(name), pygame.mixer.Channel(len(self.streams))
+    )
+    stream.play(volume, loops)
+    self.streams.append(stream)
+
+  def update(self):
+    """Keep streams fed, call regularly while they play"""
+    for stream in self.streams:
+      stream.update()
+
+  def stop(self):
+    """Stop all sounds, music and streams"""
+    if not self.enabled():
+      return
+    for stream in self.streams:
+      stream.stop()
+    self.streams = []
+    pygame.mixer.set_reserved(0)
+    pygame.mixer.music.stop()
+    pygame.mixer.stop()
+
+  def clear(self):
+    """Stop everything and drop the loaded effects, before the mixer quits"""
+    self.stop()
+    self.sounds = {}
+
+# The sound bank shared by the whole game
+bank = SoundBank()
@@ -0,0 +1,488 @@
+# Benchmark script, runs the game headless through scripted scenarios
+
+import os
+import sys
+import gc
+import json
+import random
+import argparse
+import platform
+import tempfile
+import subprocess
+from timeit import default_timer
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+try:
+  import tracemalloc
+except ImportError:
+  # Python 2, allocations are estimated from the garbage collector instead
+  tracemalloc = None
+
+import pygame
+from pygame.locals import *
+
+from consts import *
+from game import FroggerGameEngine
+from fleet import CarFleet
+from lanes import Lane
+from scores import ScoreStore
+from characters import Car, Frog
+from objects import Hut, Egg, DeadChickenPopup
+from text import TextObject
+import controllers
+
+# Frames run before timing starts, for caches to fill and the level to settle
+WARMUP_FRAMES = 60
+FRAMES = 600
+PERCENTILES = (50, 95, 99)
+
+# Metrics compared against a baseline, and whether bigger is better
+COMPARED_METRICS = [
+  ('frame_ms.p50', False),
+  ('frame_ms.p95', False),
+  ('frame_ms.p99', False),
+  ('steps_per_second', True),
+  ('objects_per_second', True),
+  ('store_open_ms', False),
+  ('peak_rss_kb', False),
+]
+THRESHOLD = 0.1
+
+# Entities of each type made when measuring memory
+ENTITIES = 10000
+
+
+class StressLevelController(controllers.LevelController):
+  """Lays out STRESS_CARS cars spread evenly over the road lanes, all of
+  them on screen at once"""
+
+  STRESS_CARS = 5000
+
+  def generate_lanes(self, level):
+    road = [
+      (i, lane) for i, lane in enumerate(self.CAR_GENERATOR_VARS) if lane[0]
+    ]
+
+    lanes = []
+    for j, (i, lane) in enumerate(road):
+      count = self.STRESS_CARS * (j + 1) // len(road) \
+        - self.STRESS_CARS * j // len(road)
+      lanes.append(Lane(i, lane[4], Lane.get_velocity(i, level, lane[2]),
+        [self.engine.random.random() * SCREEN_WIDTH for k in range(count)],
+        [self.engine.random.choice(lane[3]) for k in range(count)],
+        self.engine.get_ticks()
+      ))
+    return lanes
+
+
+class BenchmarkEngine(FroggerGameEngine):
+  """The game with its scores kept away from the player's own, and the same
+  level layouts every run"""
+
+  SCORE_DB = os.path.join(tempfile.gettempdir(), "frogger_bench.db")
+  SCORE_CSV = None
+
+  def __init__(self, headless=True, render=None, seed=0):
+    super(BenchmarkEngine, self).__init__(headless, render, seed)
+    # Metrics a scenario measures while it sets up, name -> value
+    self.metrics = {}
+
+
+class StressEngine(BenchmarkEngine):
+  STATES = dict(BenchmarkEngine.STATES, game=[
+    StressLevelController if c is controllers.LevelController else c
+    for c in BenchmarkEngine.STATES['game']
+  ])
+
+
+def press(engine, key, frames=2):
+  """Press a key then run a few frames for it to take effect"""
+  engine.feed_event(pygame.event.Event(KEYDOWN, key=key, unicode=u'', mod=0))
+  engine.run(frames)
+
+def get_controller(engine, cls):
+  for controller in engine.active_controllers:
+    if isinstance(controller, cls):
+      return controller
+
+
+def remove_score_db():
+  path = BenchmarkEngine.SCORE_DB
+  for suffix in ('', '-wal', '-shm'):
+    if os.path.exists(path + suffix):
+      os.remove(path + suffix)
+
+
+# Scenarios, each returns an engine ready to be timed
+
+def menu_idle(render):
+  return BenchmarkEngine(headless=True, render=render)
+
+def normal_level(render):
+  engine = BenchmarkEngine(headless=True, render=render)
+  press(engine, K_RETURN)
+  return engine
+
+def level_50(render):
+  engine = normal_level(render)
+  game = get_controller(engine, controllers.GameController)
+  game.level = 50
+  game.reset()
+  engine.run(2)
+  return engine
+
+def stress_5k(render):
+  engine = StressEngine(headless=True, render=render)
+  press(engine, K_RETURN)
+  return engine
+
+def scoreboard_1m(render, scores=1000000):
+  """The score board over a fresh store of scores, opened by the engine as
+  part of the set up. Opening the store and the first rank lookup, what the
+  game over screen waits on, are timed as store_open_ms"""
+  remove_score_db()
+  store = ScoreStore(BenchmarkEngine.SCORE_DB)
+  rng = random.Random(0)
+  chunk = 100000
+  for start in range(0, scores, chunk):
+    store.add_many([
+      (u"player{}".format(rng.randrange(10000)), rng.randrange(1000))
+      for i in range(min(chunk, scores - start))
+    ])
+  store.close()
+
+  start = default_timer()
+  store = ScoreStore(BenchmarkEngine.SCORE_DB)
+  store.rank(rng.randrange(1000))
+  store_open = default_timer() - start
+  store.close()
+
+  engine = BenchmarkEngine(headless=True, render=render)
+  engine.metrics['store_open_ms'] = store_open * 1000
+  press(engine, K_h)
+  return engine
+
+SCENARIOS = [
+  ('menu_idle', menu_idle),
+  ('normal_level', normal_level),
+  ('level_50', level_50),
+  ('stress_5k', stress_5k),
+  ('scoreboard_1m', scoreboard_1m),
+]
+
+
+def count_entities(engine):
+  """Return the number of game objects, counting each car in a fleet"""
+  count = 0
+  for obj in engine.objects:
+    count += len(obj) if isinstance(obj, CarFleet) else 1
+  return count
+
+def percentile(ordered, p):
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+
+def get_peak_rss():
+  """Return the peak resident set size of this process in KB"""
+  if resource is None:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # Bytes on macOS, KB elsewhere
+  return rss // 1024 if sys.platform == 'darwin' else rss
+
+def measure_allocations(engine, frames):
+  """Run frames and return how much they allocated. With tracemalloc this is
+  the memory allocated and still held, and the peak above the start.
+  Otherwise it's the growth in objects tracked by the garbage collector"""
+  if tracemalloc is not None:
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    engine.run(frames)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+      'method': 'tracemalloc',
+      'net_bytes_per_frame': (current - start) / float(frames),
+      'peak_bytes': peak - start,
+    }
+
+  gc.collect()
+  start = len(gc.get_objects())
+  engine.run(frames)
+  return {
+    'method': 'gc',
+    'net_objects_per_frame': (len(gc.get_objects()) - start) / float(frames),
+  }
+
+def run_scenario(name, frames=FRAMES, render=True):
+  """Time a scenario in this process, returning its results"""
+  setup = dict(SCENARIOS)[name]
+
+  start = default_timer()
+  engine = setup(render)
+  engine.run(WARMUP_FRAMES)
+  setup_time = default_timer() - start
+
+  objects = count_entities(engine)
+  steps = engine.simulated_time
+
+  times = []
+  start = default_timer()
+  for i in range(frames):
+    frame_start = default_timer()
+    engine.tick()
+    times.append(default_timer() - frame_start)
+  elapsed = default_timer() - start
+  steps = (engine.simulated_time - steps) / engine.step_time
+
+  allocations = measure_allocations(engine, min(frames, 100))
+  engine.quit()
+  remove_score_db()
+
+  ordered = sorted(t * 1000 for t in times)
+  frame_ms = dict(
+    ('p{}'.format(p), percentile(ordered, p)) for p in PERCENTILES
+  )
+  frame_ms['mean'] = sum(ordered) / len(ordered)
+  frame_ms['max'] = ordered[-1]
+
+  results = {
+    'frames': frames,
+    'setup_seconds': setup_time,
+    'elapsed_seconds': elapsed,
+    'fps': frames / elapsed,
+    'frame_ms': frame_ms,
+    'objects': objects,
+    'steps_per_second': steps / elapsed,
+    # Cars in a fleet still collide, report dirty rects and draw each step
+    'objects_per_second': objects * steps / elapsed,
+    'allocations': allocations,
+    'peak_rss_kb': get_peak_rss(),
+  }
+  results.update(engine.metrics)
+  return results
+
+def get_entity_factories(engine, count):
+  """Return (name, factory) for each type of entity, the factory making the
+  entity numbered i of count, owned by the level"""
+  level = get_controller(engine, controllers.LevelController)
+  road = [lane for lane in level.CAR_GENERATOR_VARS if lane[0]]
+  lane = Lane(1, road[0][4], Lane.get_velocity(1, 1, road[0][2]),
+    [k * float(SCREEN_WIDTH) / count for k in range(count)],
+    [road[0][3][k % len(road[0][3])] for k in range(count)]
+  )
+
+  return [
+    ('Car', lambda i: Car(level, lane, i)),
+    ('Frog', lambda i: Frog(level)),
+    ('Hut', lambda i: Hut(level, (i % SCREEN_WIDTH, GRID))),
+    ('Egg', lambda i: Egg(level, (i % SCREEN_WIDTH, 0))),
+    ('DeadChickenPopup', lambda i: DeadChickenPopup(level)),
+    ('TextObject', lambda i: TextObject(level, text=str(i % 100))),
+  ]
+
+def get_owned_bytes(entities):
+  """Estimate the bytes each entity uses from sys.getsizeof of it, its
+  __dict__ if it has one, and what its attributes hold that no other entity
+  shares, such as its position and rect"""
+  def get_values(entity):
+    values = []
+    for cls in type(entity).__mro__:
+      for name in cls.__dict__.get('__slots__', ()):
+        if hasattr(entity, name):
+          values.append(getattr(entity, name))
+    values.extend(getattr(entity, '__dict__', {}).values())
+    # Positions are tuples of numbers only they hold
+    for value in list(values):
+      if isinstance(value, tuple):
+        values.extend(value)
+    return dict((id(value), value) for value in values).values()
+
+  # How many entities hold each value
+  references = {}
+  for entity in entities:
+    for value in get_values(entity):
+      references[id(value)] = references.get(id(value), 0) + 1
+
+  total = 0
+  for entity in entities:
+    total += sys.getsizeof(entity)
+    if hasattr(entity, '__dict__'):
+      total += sys.getsizeof(entity.__dict__)
+    for value in get_values(entity):
+      if references[id(value)] == 1:
+        total += sys.getsizeof(value)
+  return total
+
+def measure_entity(factory, count=ENTITIES):
+  """Return the bytes per entity of count entities made by factory, ticked
+  once. With tracemalloc this is what making them allocated, otherwise it's
+  estimated by get_owned_bytes"""
+  gc.collect()
+  if tracemalloc is not None:
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+
+  entities = [None] * count
+  for i in range(count):
+    entities[i] = factory(i)
+    # Objects in the collision index would count it as well
+    if not entities[i].COLLIDABLE:
+      entities[i].tick()
+
+  if tracemalloc is not None:
+    used = tracemalloc.get_traced_memory()[0] - start - sys.getsizeof(entities)
+    tracemalloc.stop()
+  else:
+    used = get_owned_bytes(entities)
+  return used / float(count)
+
+def run_memory(count=ENTITIES):
+  """Measure the memory each type of entity uses, returning the results"""
+  engine = normal_level(False)
+  entities = dict(
+    (name, measure_entity(factory, count))
+    for name, factory in get_entity_factories(engine, count)
+  )
+  engine.quit()
+  remove_score_db()
+
+  return {
+    'python': platform.python_version(),
+    'method': 'tracemalloc' if tracemalloc is not None else 'getsizeof',
+    'count': count,
+    'bytes_per_entity': entities,
+  }
+
+def run(names, frames=FRAMES, render=True):
+  """Run each scenario in its own process, so peak memory and asset caches
+  are its own, returning the results for all of them"""
+  scenarios = {}
+  for name in names:
+    command = [
+      sys.executable, os.path.abspath(__file__), 'scenario', name,
+      '--frames', str(frames),
+    ]
+    if not render:
+      command.append('--no-render')
+    print >>sys.stderr, "Running {}...".format(name)
+    output = subprocess.check_output(command, cwd=os.path.dirname(command[1]))
+    # The results are the last line, after anything the game printed
+    scenarios[name] = json.loads(output.strip().splitlines()[-1])
+
+  return {
+    'python': platform.python_version(),
+    'numpy': CarFleet.available(),
+    'render': render,
+    'scenarios': scenarios,
+  }
+
+
+def get_metric(results, metric):
+  for key in metric.split('.'):
+    results = results.get(key) if results else None
+  return results
+
+def compare(baseline, current, threshold=THRESHOLD):
+  """Compare results against a baseline, returning a line for each metric
+  and whether anything got worse by more than threshold"""
+  lines = []
+  regressed = False
+  for name in sorted(current['scenarios']):
+    if name not in baseline['scenarios']:
+      lines.append("{}: not in baseline".format(name))
+      continue
+
+    for metric, bigger_is_better in COMPARED_METRICS:
+      old = get_metric(baseline['scenarios'][name], metric)
+      new = get_metric(current['scenarios'][name], metric)
+      if not old or new is None:
+        continue
+
+      change = (new - old) / float(old)
+      worse = -change if bigger_is_better else change
+      flag = ""
+      if worse > threshold:
+        flag = "  REGRESSION"
+        regressed = True
+      lines.append("{}: {} {:.4g} -> {:.4g} ({:+.1%}){}".format(
+        name, metric, old, new, change, flag
+      ))
+
+  return lines, regressed
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description="Benchmark the game headless")
+  commands = parser.add_subparsers(dest='command')
+
+  names = [name for name, setup in SCENARIOS]
+
+  run_parser = commands.add_parser('run', help="run the benchmarks")
+  run_parser.add_argument('scenarios', nargs='*', metavar='scenario',
+    help="scenarios to run, all of them by default: " + ", ".join(names))
+  run_parser.add_argument('--frames', type=int, default=FRAMES)
+  run_parser.add_argument('--no-render', action='store_true',
+    help="simulate without drawing")
+  run_parser.add_argument('--output', metavar='PATH',
+    help="write the JSON results to PATH rather than printing them")
+
+  scenario_parser = commands.add_parser('scenario',
+    help="run one scenario in this process")
+  scenario_parser.add_argument('name', choices=names)
+  scenario_parser.add_argument('--frames', type=int, default=FRAMES)
+  scenario_parser.add_argument('--no-render', action='store_true')
+
+  memory_parser = commands.add_parser('memory',
+    help="measure the bytes used by each type of entity")
+  memory_parser.add_argument('--count', type=int, default=ENTITIES,
+    help="entities of each type to make, default %(default)s")
+
+  compare_parser = commands.add_parser('compare',
+    help="flag regressions against a baseline, exiting 1 if there are any")
+  compare_parser.add_argument('baseline')
+  compare_parser.add_argument('current')
+  compare_parser.add_argument('--threshold', type=float, default=THRESHOLD,
+    help="fraction a metric can get worse by, default %(default)s")
+
+  args = parser.parse_args()
+  if args.command == 'run':
+    for name in args.scenarios:
+      if name not in names:
+        run_parser.error("unknown scenario {}".format(name))
+  return args
+
+if __name__ == "__main__":
+  args = parse_args()
+
+  if args.command == 'scenario':
+    results = run_scenario(args.name, args.frames, not args.no_render)
+    print json.dumps(results)
+
+  elif args.command == 'run':
+    results = run(
+      args.scenarios or [name for name, setup in SCENARIOS],
+      args.frames, not args.no_render
+    )
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+      with open(args.output, 'w') as f:
+        f.write(output)
+    else:
+      print output
+
+  elif args.command == 'memory':
+    print json.dumps(run_memory(args.count), indent=2, sort_keys=True)
+
+  elif args.command == 'compare':
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    with open(args.current) as f:
+      current = json.load(f)
+    lines, regressed = compare(baseline, current, args.threshold)
+    for line in lines:
+      print line
+    sys.exit(1 if regressed else 0)
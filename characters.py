@@ -2,11 +2,14 @@ import pygame
 
 from objects import MovableObject, CollisionDetectionMixin
 from consts import *
+from assets import registry
 
 class Character(MovableObject):
   """Characters are objects that are a bit more intelligent. They know
   where they should start at and handle their own velocity"""
 
+  __slots__ = ()
+
   def __init__(self, controller, *args, **kwargs):
     # Run the object init method
     super(Character, self).__init__(controller)
@@ -20,6 +23,8 @@ class Character(MovableObject):
 class Frog(Character, CollisionDetectionMixin):
   """The player object, is a chicken rather than a frog"""
 
+  __slots__ = ()
+
   IMAGE = "chicken.png"
   PLACEHOLDER_COLOUR = RED
   Z_INDEX = 5
@@ -30,70 +35,61 @@ class Frog(Character, CollisionDetectionMixin):
   def move_to_start(self):
     """Move the frog to the starting position"""
     self.pos = (SCREEN_WIDTH / 2, SCREEN_HEIGHT - 64)
+    self.snap()
 
   def move(self, rel_pos):
     """Move the frog the provided number of GRID squares, (x, y)"""
     self.pos = (self.pos[0] + rel_pos[0] * GRID, self.pos[1] + rel_pos[1] * GRID)
+    self.snap()
 
 class Car(Character):
-  """The 'car' object, it drives on roads and collides with the player"""
+  """The 'car' object, it drives on roads and collides with the player.
+  Everything but which car of which lane it is comes from the lane"""
+
+  __slots__ = ('lane', 'index', 'image')
 
   SPEED = 0.01
   SPEED_INCREMENT = 0.01
   LANE_HEIGHT = GRID
   LANE_ORIGIN = SCREEN_HEIGHT - (GRID * 3)
   CAR_SPACING = 64
+  COLLIDABLE = True
 
-  def create(self, lane, delay, level, speed_multiplier, image_path, width):
-    # Store as instance variables
+  def create(self, lane, index):
+    """Be car index of a Lane, which decides where the car is"""
     self.lane = lane
-    self.width = width
-
-    # Set the position based on provided params
-    py = self.LANE_ORIGIN - (self.LANE_HEIGHT * lane)
-    px = delay * self.CAR_SPACING
-    self.pos = (px, py)
-
-    # Set the speed based on level and individual speed_multiplier
-    self.set_speed((level + 1) * speed_multiplier)
+    self.index = index
+    self.pos = (
+      lane.position(index, self.controller.engine.get_ticks()), lane.y
+    )
 
     # Set the image, and if in a right moving lane flip in the horizontal
-    self.image = self.get_image(image_path)
-    if self.lane % 2:
-      # If move to right, flip image in x
-      self.image = pygame.transform.flip(self.image, True, False)
-
-  def set_speed(self, level):
-    """Set the velocity of the object"""
-    speed = self.SPEED + (self.SPEED_INCREMENT * level)
-
-    if self.lane % 2:
-      # Move to the right
-      self.velocity = (speed, 0)
-    else:
-      # Move to the left
-      self.velocity = (-speed, 0)
+    self.image = registry.get_image(
+      lane.image_paths[index], flip_x=lane.moves_right()
+    )
+
+  @property
+  def velocity(self):
+    return (self.lane.velocity, 0)
 
   def get_width(self):
     # Override object get_width function
-    return self.width
+    return self.lane.width
 
   def tick_move(self):
-    """Move the object based on velocity with wrapping"""
-    if self.velocity[0] > 0 and self.pos[0] > SCREEN_WIDTH:
-      # Moving right, reposition to off the left of the screen
-      new_pos = (-self.width, self.pos[1])
-    elif self.velocity[0] < 0 and self.pos[0] < -self.width:
-      # Moving left, reposition to off the right of the screen
-      new_pos = (SCREEN_WIDTH + self.width, self.pos[1])
-    else:
-      # Car not offscreen, move as normal
-      new_pos = (
-        self.pos[0] + (self.velocity[0] * self.controller.engine.last_tick),
-        self.pos[1]
-      )
-
-    self.pos = new_pos
+    """Move to where the lane has the car at the end of this step"""
+    engine = self.controller.engine
+    self.pos = (
+      self.lane.position(self.index, engine.get_ticks() + engine.last_tick),
+      self.pos[1]
+    )
+
+  def get_draw_pos(self, alpha):
+    """Where the lane has the car alpha of the way through the last step,
+    wrapping rather than sliding across the screen"""
+    engine = self.controller.engine
+    t = engine.get_ticks() - (1 - alpha) * engine.step_time
+    return (self.lane.position(self.index, t), self.pos[1])
 
 
 
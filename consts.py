@@ -50,6 +50,17 @@ END = "end.png"
 DEAD_CHICKEN = "dead_chicken.png"
 ALIVE_CHICKEN = "alive_chicken.png"
 
+# Sounds, long tracks are streamed, effects loaded once
+
+SND_MENU = "GameMenu.wav"
+SND_SOUNDTRACK = "GameSoundtrack.wav"
+SND_TRAFFIC = "GameTraffic.wav"
+
+SND_WIN = "GameWin.wav"
+SND_DIE = "GameDie.wav"
+SND_JUMP = "Jump.wav"
+SND_GAME_OVER = "GameOver.wav"
+
 
 # Keymap controls
 
@@ -77,6 +88,7 @@ E_ENABLE_MOVEMENT = 5007
 E_TEXT_CAPTURE = 5008
 E_SCORE_SAVED = 5009
 E_LEVEL_CHANGED = 5010 #
+E_SCORE_SAVE_FAILED = 5011
 
 # Directions
 
@@ -1,6 +1,5 @@
 import re
-import csv
-import random
+import math
 import pygame
 from pygame.locals import *
 
@@ -9,6 +8,10 @@ from object_manager import ObjectManagerMixin
 from characters import *
 from objects import *
 from text import TextObject
+from fleet import CarFleet
+from lanes import Lane
+from occupancy import OccupancyGrid, AutoPlayer
+from audio import bank
 
 class BaseController(object):
   pass
@@ -16,7 +19,10 @@ class BaseController(object):
 class Controller(BaseController, ObjectManagerMixin):
   """Controllers manage various aspects of the game, they can manage objects,
   interact via events and request changes to the state of the game"""
-  EVENT_BINDINGS = [] # Empty bindings
+  EVENT_BINDINGS = {} # Empty bindings
+
+  # Set by the engine while the controller is in the active state
+  active = False
 
   def __init__(self, engine, messages):
     super(Controller, self).__init__()
@@ -51,11 +57,9 @@ class MenuController(Controller):
   def create(self):
     self.engine.set_background_image(BG_MENU)
 
-	#play menu music
+	#play menu music, streamed
 
-    self.menu_music = pygame.mixer.Sound('sounds/GameMenu.wav')
-    self.menu_music.set_volume(self.MENU_VOLUME)
-    self.menu_music.play(-1)
+    bank.play_music(SND_MENU, self.MENU_VOLUME)
 
     self.start_text = self.create_object(TextObject, self,
       font_size=64,
@@ -74,7 +78,7 @@ class MenuController(Controller):
   #Stopmusic
   def destroy(self):
     super(MenuController, self).destroy()
-    pygame.mixer.stop()
+    bank.stop()
 
   def start_game(self):
     self.engine.setup_state('game')
@@ -215,7 +219,7 @@ class PlayerController(Controller):
     # Deal with collisions
     collision_object = self.player_object.collision_check()
     if collision_object and self.player_object.visible:
-      if isinstance(collision_object, Car):
+      if isinstance(collision_object, (Car, CarFleet)):
         # Collided with Car, so die
         self.player_object.visible = False
         self.engine.post_event(E_DIE)
@@ -289,23 +293,46 @@ class LevelController(Controller):
     for hut_pos in self.HUT_POSITIONS:
       self.huts.append(self.create_object(Hut, self, hut_pos))
 
-  def reset(self, event):
-    """Regenerate the level"""
-    self.purge_objects(Car)
+    # The road's lanes, where their cars are can be asked of any time
+    self.lanes = []
+
+    # Draw the cars as a vectorised fleet when NumPy is available
+    self.fleet = None
+    if CarFleet.available():
+      self.fleet = self.create_object(CarFleet, self)
 
+  def generate_lanes(self, level):
+    """Randomly lay out the cars from CAR_GENERATOR_VARS, returning a Lane
+    for each lane with cars in, starting now"""
+    lanes = []
     for i, lane in enumerate(self.CAR_GENERATOR_VARS):
+      if not lane[0]:
+        continue
       total_delay = 0
+      offsets = []
+      image_paths = []
       for j in range(lane[0]):
-        total_delay += random.randrange(*lane[1])
-        image_path = random.choice(lane[3])
-        car = self.create_object(Car, self,
-          lane=i,
-          delay=total_delay,
-          level=event.level,
-          speed_multiplier=lane[2],
-          image_path=image_path,
-          width=lane[4],
-        )
+        total_delay += self.engine.random.randrange(*lane[1])
+        offsets.append(total_delay * Car.CAR_SPACING)
+        image_paths.append(self.engine.random.choice(lane[3]))
+      lanes.append(Lane(i, lane[4], Lane.get_velocity(i, level, lane[2]),
+        offsets, image_paths, self.engine.get_ticks()
+      ))
+    return lanes
+
+  def reset(self, event):
+    """Regenerate the level"""
+    self.lanes = self.generate_lanes(event.level)
+
+    if self.fleet is not None:
+      self.fleet.populate(self.lanes)
+      return
+
+    # Reuse the Car objects from the last layout
+    self.release_objects(Car)
+    for lane in self.lanes:
+      for k in range(len(lane)):
+        self.acquire_object(Car, lane=lane, index=k)
 
   EVENT_BINDINGS = {
     E_SOFT_RESET: reset
@@ -313,10 +340,16 @@ class LevelController(Controller):
 
 
 class FPSCounterController(Controller):
-  """Optional controller to show the FPS at the top of the screen"""
+  """Optional controller to show the FPS at the top of the screen, and the
+  frame profiler's timings below it"""
 
   FPS_POS = (300, 0)
 
+  # Where the profiler overlay starts, and how often it's refreshed, in ticks
+  OVERLAY_POS = (8, 40)
+  OVERLAY_FONT_SIZE = 14
+  OVERLAY_REFRESH = 30
+
   def create(self):
     self.fps_text = self.create_object(TextObject, self,
       text="0",
@@ -325,13 +358,53 @@ class FPSCounterController(Controller):
     )
     self.fps_text.visible = False
 
+    self.overlay_texts = []
+    self.ticks = 0
+
+    # The profiler outlives us across state changes, keep showing it if on
+    if self.engine.profiler.enabled:
+      self.fps_text.visible = True
+
   def tick(self):
     super(FPSCounterController, self).tick()
     self.fps_text.set_text(self.engine.get_fps())
 
+    self.ticks += 1
+    if self.engine.profiler.enabled and self.ticks % self.OVERLAY_REFRESH == 0:
+      self.update_overlay()
+
+  def update_overlay(self):
+    """Show the profiler summary, one text object per line"""
+    lines = self.engine.profiler.get_summary()
+
+    for i in range(len(self.overlay_texts), len(lines)):
+      self.overlay_texts.append(self.create_object(TextObject, self,
+        font_size=self.OVERLAY_FONT_SIZE,
+        pos=(
+          self.OVERLAY_POS[0],
+          self.OVERLAY_POS[1] + (self.OVERLAY_FONT_SIZE + 2) * i
+        ),
+        colour=RED,
+      ))
+
+    for i, text in enumerate(self.overlay_texts):
+      text.visible = i < len(lines)
+      if text.visible:
+        text.set_text(lines[i])
+
   def toggle_fps(self):
-    """Toggle display of the framerate counter"""
-    self.fps_text.visible = not self.fps_text.visible
+    """Cycle between showing nothing, the framerate counter and the
+    framerate counter with the profiler overlay"""
+    profiler = self.engine.profiler
+    if not self.fps_text.visible:
+      self.fps_text.visible = True
+    elif not profiler.enabled:
+      profiler.enable()
+    else:
+      profiler.enable(False)
+      self.fps_text.visible = False
+      for text in self.overlay_texts:
+        text.visible = False
 
   EVENT_BINDINGS = {
     K_f: toggle_fps,
@@ -380,12 +453,13 @@ class ScoreTextController(Controller):
     self.level_text.set_text("Level: {}".format(event.level)) 
 
   def update_eggs(self):
-    # Remove all objects
-    self.purge_objects(Egg)
+    # Remove all objects, keeping them to reuse
+    self.release_objects(Egg)
+    self.eggs = []
 
     # Create objects (Eggs) to represent lives
     for i in range(self.lives):
-      egg = self.create_object(Egg, self,
+      egg = self.acquire_object(Egg,
         pos=(self.EGG_ORIGIN[0] + (GRID * i), self.EGG_ORIGIN[1]))
       self.eggs.append(egg)
 
@@ -409,37 +483,36 @@ class SoundController(Controller):
   ROAD_VOLUME = 0.1
 
   def create(self):
-	# Background music
-    self.sound = pygame.mixer.Sound('sounds/GameSoundtrack.wav')
-    self.sound.set_volume(self.BACKGROUND_VOLUME)
-    self.sound.play(-1)
+	# Background music, streamed
+    bank.play_music(SND_SOUNDTRACK, self.BACKGROUND_VOLUME)
+
+    # Background sound effect, streamed alongside the music
+    bank.stream(SND_TRAFFIC, self.ROAD_VOLUME)
 
-    # Background sound effect
-    self.road = pygame.mixer.Sound('sounds/GameTraffic.wav')
-    self.road.set_volume(self.ROAD_VOLUME)
-    self.road.play(-1)
+    # Preload sounds, these are kept loaded between games
+    bank.preload([SND_WIN, SND_DIE, SND_JUMP])
 
-    # Preload sounds
-    self.win = pygame.mixer.Sound('sounds/GameWin.wav')
-    self.die = pygame.mixer.Sound('sounds/GameDie.wav')
-    self.jump = pygame.mixer.Sound('sounds/Jump.wav')
+  def tick(self):
+    super(SoundController, self).tick()
+    # Keep the streamed background sound playing
+    bank.update()
 
   def destroy(self):
     """Stop all running sounds"""
     super(SoundController, self).destroy()
-    pygame.mixer.stop()
+    bank.stop()
 
   def win(self, event):
     """Play win sound"""
-    self.win.play()
+    bank.play(SND_WIN)
 
   def die(self, event):
     """Play die sound"""
-    self.die.play()
+    bank.play(SND_DIE)
 
   def jump(self, event):
     """Play jump sound"""
-    self.jump.play()
+    bank.play(SND_JUMP)
 
   EVENT_BINDINGS = {
     E_WIN: win,
@@ -457,7 +530,7 @@ class PopupController(Controller):
 
   def show_popup(self, obj, duration=1000):
     """Show a popup"""
-    popup = self.create_object(obj, self)
+    popup = self.acquire_object(obj)
     popup.set_pos_centre()
     self.hide_popup = self.engine.get_ticks() + duration
     self.engine.post_event(E_DISABLE_MOVEMENT)
@@ -474,7 +547,7 @@ class PopupController(Controller):
     super(PopupController, self).tick()
     """Remove popups after their time is done"""
     if len(self.objects) > 0 and self.engine.get_ticks() > self.hide_popup:
-      self.purge_objects()
+      self.release_objects()
       self.engine.post_event(E_ENABLE_MOVEMENT)
 
   EVENT_BINDINGS = {
@@ -483,6 +556,97 @@ class PopupController(Controller):
   }
 
 
+class AutoPlayerController(Controller):
+  """Plays the game by pressing the PlayerController's keys, hopping or
+  waiting every HOP_STEPS steps along a path planned through an occupancy
+  grid of where the level's cars will be. Restarts the game RESTART_DELAY ms
+  after a game over. Must come before the PlayerController in a state, so
+  hops happen before the step's collision check"""
+
+  HOP_STEPS = 3
+  RESTART_DELAY = 3000
+
+  KEYS = {
+    LEFT: KM_LEFT,
+    RIGHT: KM_RIGHT,
+    UP: KM_UP,
+    DOWN: KM_DOWN,
+  }
+
+  def create(self):
+    self.planner = AutoPlayer()
+    self.grid = None
+    # Directions still to play, with the cell each should leave us in
+    self.plan = []
+    self.game_over_time = None
+
+  def get_controller(self, cls):
+    for controller in self.engine.active_controllers:
+      if isinstance(controller, cls):
+        return controller
+
+  def tick(self):
+    super(AutoPlayerController, self).tick()
+
+    player = self.get_controller(PlayerController)
+    level = self.get_controller(LevelController)
+    if player is None or level is None:
+      # Game over
+      now = self.engine.get_ticks()
+      if self.game_over_time is None:
+        self.game_over_time = now
+      elif now - self.game_over_time >= self.RESTART_DELAY:
+        self.engine.dispatch(K_RETURN)
+      return
+
+    if not player.movement_allowed() or not level.lanes:
+      self.plan = []
+      return
+
+    # A new grid for each new layout. Car objects set their collision rect
+    #  before moving, so are checked where they were a step ago
+    if self.grid is None or self.grid.lanes is not level.lanes:
+      self.grid = OccupancyGrid(level.lanes,
+        self.engine.step_time, self.HOP_STEPS,
+        player.player_object.get_width(),
+        0 if level.fleet is not None else 1
+      )
+      self.plan = []
+
+    slot, step = self.grid.get_slot(self.engine.get_ticks())
+    if step:
+      return
+
+    pos = player.player_object.pos
+    cell = (int(pos[1]) // GRID, int(pos[0]) // GRID)
+    if not self.plan or self.plan[0][1] != cell:
+      self.plan = self.make_plan(level, cell, slot)
+
+    if self.plan:
+      direction, cell = self.plan.pop(0)
+      if direction is not None:
+        self.engine.dispatch(self.KEYS[direction])
+
+  def make_plan(self, level, cell, slot):
+    """Plan from a cell to a hut, returning a list of (direction, cell
+    before the hop)"""
+    goals = 0
+    for hut in level.huts:
+      goals |= 1 << (int(hut.pos[0]) // GRID)
+
+    directions = self.planner.plan(self.grid, cell[0], cell[1], slot, goals)
+    if not directions:
+      return []
+
+    plan = []
+    row, column = cell
+    for direction in directions:
+      plan.append((direction, (row, column)))
+      row += {UP: -1, DOWN: 1}.get(direction, 0)
+      column += {LEFT: -1, RIGHT: 1}.get(direction, 0)
+    return plan
+
+
 class GameOverController(Controller):
   """Draws the gameover screen along with the player score"""
   GAMEOVER_VOLUME = 0.9
@@ -490,11 +654,9 @@ class GameOverController(Controller):
     self.engine.set_background_image(BG_GAME_OVER)
 
     # Gameover sound
-    self.gameOver = pygame.mixer.Sound('sounds/GameOver.wav')
-    self.gameOver.set_volume(self.GAMEOVER_VOLUME)
-    self.gameOver.play()
+    bank.play(SND_GAME_OVER, self.GAMEOVER_VOLUME)
 
-  def show_text(self, event):
+  def show_text(self, event, saved=True):
     # Create the text objects
     self.score_text = self.create_object(TextObject, self,
       font_size=64,
@@ -503,27 +665,57 @@ class GameOverController(Controller):
       text="Your Score: {}".format(self.messages['score']),
     )
 
+    # Where the score places on the leaderboard
+    score_store = self.engine.get_score_store()
+    score = self.messages['score']
+    if saved:
+      rank = "You ranked #{:,} of {:,} (top {}%)".format(
+        score_store.rank(score),
+        score_store.count(),
+        max(1, int(math.ceil(score_store.top_percent(score)))),
+      )
+    else:
+      rank = "Your score couldn't be saved"
+    self.rank_text = self.create_object(TextObject, self,
+      font_size=24,
+      pos=(0, 100),
+      centre=True,
+      text=rank,
+    )
+
+    self.best_text = self.create_object(TextObject, self,
+      font_size=16,
+      pos=(0, 128),
+      centre=True,
+      text="{}'s personal best: {}".format(
+        event.name, score_store.personal_best(event.name)
+      ),
+    )
+
     self.restart_text = self.create_object(TextObject, self,
       font_size=32,
-      pos=(0, 96),
+      pos=(0, 152),
       centre=True,
       text="Press ENTER to try again",
     )
 
     self.hs_text = self.create_object(TextObject, self,
       font_size=16,
-      pos=(0, 140),
+      pos=(0, 196),
       centre=True,
       text="Press H to see the scoreboard",
     )
 
     self.menu_text = self.create_object(TextObject, self,
       font_size=16,
-      pos=(0, 160),
+      pos=(0, 216),
       centre=True,
       text="Press SPACE to return to menu",
     )
 
+  def show_save_failed(self, event):
+    self.show_text(event, saved=False)
+
   def tick(self):
     super(GameOverController, self).tick()
 
@@ -547,6 +739,7 @@ class GameOverController(Controller):
     K_SPACE: go_menu,
     K_h: go_high_score,
     E_SCORE_SAVED: show_text,
+    E_SCORE_SAVE_FAILED: show_save_failed,
   }
 
 class ScoreBoardController(Controller):
@@ -554,19 +747,22 @@ class ScoreBoardController(Controller):
 
   def create(self):
     self.engine.set_background_image(BG_SCORE_BOARD)
-    name_score = []
-
-    with open("high_score.csv", 'rb') as f:
-      high_score_reader = csv.reader(f)
-      for line in high_score_reader:
-        name_score.append(line)
+    score_store = self.engine.get_score_store()
+    name_score = score_store.top(8)
 
-    name_score.sort(key = lambda i: -int(i[1]))
-
-    for j, x in enumerate(name_score[:8]):
+    for j, x in enumerate(name_score):
+      board_rank = (280, (120+(24+4)*j))
       board_name = (320,(120+(24+4)*j))
       board_score = (600, (120+(24+4)*j))
 
+      # Equal scores share a rank
+      self.create_object(TextObject, self,
+        font_size=16,
+        colour=BLACK,
+        pos=board_rank,
+        text="#{}".format(score_store.rank(x[1]))
+        )
+
       self.create_object(TextObject, self,
         font_size=16,
         colour=BLACK,
@@ -581,6 +777,14 @@ class ScoreBoardController(Controller):
         text="{}".format(x[1])
         )
 
+    self.create_object(TextObject, self,
+      font_size=16,
+      colour=BLACK,
+      pos=(0, 120 + (24+4)*8),
+      centre=True,
+      text="{:,} scores recorded".format(score_store.count()),
+      )
+
     self.create_object(TextObject, self,
       font_size=58,
       pos=(0, SCREEN_HEIGHT - 80),
@@ -627,10 +831,9 @@ class HighScoreController(Controller):
       self.name = self.name[:-1]
       self.update_name_text()
     elif event.key == K_RETURN:
-      # Input is enter, save and return to gameover state
+      # Input is enter, save and return to gameover state once saved
       self.save_score()
       self.engine.capture_text = False # Enable engine event handling
-      self.engine.post_event(E_SCORE_SAVED)
       self.purge_objects() # Get rid of our text
 
   def update_name_text(self):
@@ -639,10 +842,13 @@ class HighScoreController(Controller):
     self.name_text.set_pos_centre((1,0))
 
   def save_score(self):
-    """Save the score to CSV file"""
-    with open("high_score.csv", "a") as f:
-      writer = csv.writer(f)
-      writer.writerow((self.name, self.messages['score']))
+    """Save the score to the score store in the background, E_SCORE_SAVED is
+    posted once it's on disk, or E_SCORE_SAVE_FAILED if it couldn't be"""
+    name = self.name
+    self.engine.get_score_store().save(name, self.messages['score'],
+      on_saved=lambda: self.engine.post_event(E_SCORE_SAVED, name=name),
+      on_failed=lambda: self.engine.post_event(E_SCORE_SAVE_FAILED, name=name)
+    )
 
   EVENT_BINDINGS = {
     E_TEXT_CAPTURE: user_input,
@@ -0,0 +1,286 @@
+import multiprocessing
+
+from consts import *
+from game import FroggerGameEngine
+from characters import Car, Frog
+from objects import Hut
+from fleet import CarFleet
+import controllers
+
+# NumPy is needed for observations, without it environments can't be made
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+# Observations are the screen as a grid of GRID sized cells, each holding
+#  what is in it
+ROWS = SCREEN_HEIGHT // GRID
+COLUMNS = SCREEN_WIDTH // GRID
+
+OBS_EMPTY = 0
+OBS_CAR = 1
+OBS_HUT = 2
+OBS_PLAYER = 3
+
+# Actions are indexes into ACTIONS, the key pressed for each
+ACTIONS = (None, KM_UP, KM_DOWN, KM_LEFT, KM_RIGHT)
+
+
+class EnvironmentEngine(FroggerGameEngine):
+  """The game with only what's needed to play it, no menus, text, sound or
+  popups, starting straight into a game. Losing the last life leaves just the
+  GameController running"""
+
+  STATES = {
+    'game': [
+      controllers.GameController,
+      controllers.PlayerController,
+      controllers.LevelController,
+    ],
+    'gameover': [
+      controllers.GameController,
+    ],
+  }
+
+  STARTING_STATE = 'game'
+
+
+class Environment(object):
+  """A headless game played through reset and step, in the style of a gym
+  environment. Each step presses the action's key then runs frame_skip
+  frames of one simulation step. The reward is the points scored"""
+
+  def __init__(self, seed=None, frame_skip=1):
+    if numpy is None:
+      raise ImportError("Environments need NumPy for their observations")
+    self.frame_skip = frame_skip
+    self.engine = EnvironmentEngine(headless=True, seed=seed)
+    self.game = None
+
+  def get_game(self):
+    for controller in self.engine.active_controllers:
+      if isinstance(controller, controllers.GameController):
+        return controller
+
+  def reset(self, out=None):
+    """Start a new game, returning the first observation"""
+    self.engine.events.clear()
+    self.engine.setup_state('game', purge=True)
+    self.game = self.get_game()
+    # Deliver the reset, laying out the level
+    self.engine.tick()
+    return self.observe(out)
+
+  def step(self, action, out=None):
+    """Play an action, returning (observation, reward, done, info). done is
+    True once the last life is lost, then reset must be called"""
+    key = ACTIONS[action]
+    if key is not None:
+      self.engine.dispatch(key)
+
+    score = self.game.score
+    for i in range(self.frame_skip):
+      self.engine.tick()
+
+    info = {
+      'score': self.game.score,
+      'level': self.game.level,
+      'lives': self.game.lives,
+    }
+    return (
+      self.observe(out), self.game.score - score, self.game.lives < 1, info
+    )
+
+  def observe(self, out=None):
+    """Fill and return a ROWS by COLUMNS grid of what's in each cell"""
+    if out is None:
+      out = numpy.empty((ROWS, COLUMNS), dtype=numpy.uint8)
+    out.fill(OBS_EMPTY)
+
+    for obj in self.engine.objects:
+      if isinstance(obj, CarFleet):
+        self.observe_fleet(obj, out)
+      elif isinstance(obj, Car):
+        self.observe_rect(obj.rect, OBS_CAR, out)
+      elif isinstance(obj, Hut):
+        self.observe_rect(obj.rect, OBS_HUT, out)
+
+    # Drawn last, over anything else in its cell
+    for player in self.engine.objects.of_type(Frog):
+      self.observe_rect(player.rect, OBS_PLAYER, out)
+    return out
+
+  def observe_rect(self, rect, value, out):
+    top = max(rect.top // GRID, 0)
+    left = max(rect.left // GRID, 0)
+    out[top:(rect.bottom - 1) // GRID + 1, left:(rect.right - 1) // GRID + 1] \
+      = value
+
+  def observe_fleet(self, fleet, out):
+    """Mark the cells covered by every car in the fleet at once"""
+    if not len(fleet):
+      return
+    x = fleet.get_x(self.engine.get_ticks())
+    first = numpy.floor_divide(x, GRID).astype(int)
+    last = numpy.floor_divide(x + fleet.width - 1, GRID).astype(int)
+
+    # A column for each car and each cell along the longest car
+    column = first[:, None] + numpy.arange(int((last - first).max()) + 1)
+    cars, cells = (
+      (column <= last[:, None]) & (column >= 0) & (column < COLUMNS)
+    ).nonzero()
+    out[fleet.y[cars] // GRID, column[cars, cells]] = OBS_CAR
+
+  def close(self):
+    """Destroy the game. pygame is left running, it's shared with any other
+    environments in the process"""
+    self.engine.purge_controllers()
+
+
+class VectorEnvironment(object):
+  """count environments stepped in lockstep in this process. Observations,
+  rewards and dones are batched into arrays, reused by each step, which can
+  be passed in to have them somewhere such as shared memory. Environments
+  that finish are reset straight away, the observation returned for them is
+  the first of their next game"""
+
+  def __init__(self, count, seed=None, frame_skip=1,
+      observations=None, rewards=None, dones=None):
+    self.environments = [
+      Environment(None if seed is None else seed + i, frame_skip)
+      for i in range(count)
+    ]
+
+    if observations is None:
+      observations = numpy.zeros((count, ROWS, COLUMNS), dtype=numpy.uint8)
+    if rewards is None:
+      rewards = numpy.zeros(count, dtype=numpy.float64)
+    if dones is None:
+      dones = numpy.zeros(count, dtype=numpy.uint8)
+    self.observations = observations
+    self.rewards = rewards
+    self.dones = dones
+
+  def __len__(self):
+    return len(self.environments)
+
+  def reset(self):
+    for i, environment in enumerate(self.environments):
+      environment.reset(self.observations[i])
+    return self.observations
+
+  def step(self, actions):
+    """Play an action in each environment, returning (observations,
+    rewards, dones, infos)"""
+    infos = []
+    for i, environment in enumerate(self.environments):
+      observation, reward, done, info = environment.step(
+        actions[i], self.observations[i]
+      )
+      if done:
+        environment.reset(observation)
+      self.rewards[i] = reward
+      self.dones[i] = done
+      infos.append(info)
+    return self.observations, self.rewards, self.dones.view(bool), infos
+
+  def close(self):
+    for environment in self.environments:
+      environment.close()
+
+
+def run_worker(connection, shared, count, start, stop, seed, frame_skip):
+  """Worker process for ProcessVectorEnvironment, running the environments
+  start to stop into their part of the shared arrays"""
+  observations, rewards, dones = [
+    array[start:stop] for array in shared_arrays(count, *shared)
+  ]
+  environments = VectorEnvironment(stop - start,
+    None if seed is None else seed + start, frame_skip,
+    observations, rewards, dones
+  )
+
+  while True:
+    command, actions = connection.recv()
+    if command == 'reset':
+      environments.reset()
+      connection.send(None)
+    elif command == 'step':
+      connection.send(environments.step(actions)[3])
+    else:
+      environments.close()
+      connection.close()
+      break
+
+def shared_arrays(count, observations, rewards, dones):
+  """Return NumPy arrays over shared memory made by ProcessVectorEnvironment"""
+  return (
+    numpy.frombuffer(observations, dtype=numpy.uint8).reshape(
+      count, ROWS, COLUMNS
+    ),
+    numpy.frombuffer(rewards, dtype=numpy.float64),
+    numpy.frombuffer(dones, dtype=numpy.uint8),
+  )
+
+
+class ProcessVectorEnvironment(object):
+  """count environments stepped in lockstep, split between a pool of worker
+  processes. Workers write observations, rewards and dones straight into
+  shared memory, only actions and infos are sent between processes. Same
+  interface as VectorEnvironment"""
+
+  def __init__(self, count, processes=None, seed=None, frame_skip=1):
+    if numpy is None:
+      raise ImportError("Environments need NumPy for their observations")
+    processes = min(processes or multiprocessing.cpu_count(), count)
+
+    self.shared = (
+      multiprocessing.RawArray('B', count * ROWS * COLUMNS),
+      multiprocessing.RawArray('d', count),
+      multiprocessing.RawArray('B', count),
+    )
+    self.observations, self.rewards, self.dones = shared_arrays(
+      count, *self.shared
+    )
+
+    # Contiguous shards of environments, as even as they can be
+    self.count = count
+    self.connections = []
+    self.workers = []
+    for i in range(processes):
+      start = count * i // processes
+      stop = count * (i + 1) // processes
+      connection, worker_connection = multiprocessing.Pipe()
+      worker = multiprocessing.Process(target=run_worker, args=(
+        worker_connection, self.shared, count, start, stop, seed, frame_skip
+      ))
+      worker.daemon = True
+      worker.start()
+      self.connections.append((connection, start, stop))
+      self.workers.append(worker)
+
+  def __len__(self):
+    return self.count
+
+  def reset(self):
+    for connection, start, stop in self.connections:
+      connection.send(('reset', None))
+    for connection, start, stop in self.connections:
+      connection.recv()
+    return self.observations
+
+  def step(self, actions):
+    for connection, start, stop in self.connections:
+      connection.send(('step', actions[start:stop]))
+    infos = []
+    for connection, start, stop in self.connections:
+      infos.extend(connection.recv())
+    return self.observations, self.rewards, self.dones.view(bool), infos
+
+  def close(self):
+    for connection, start, stop in self.connections:
+      connection.send(('close', None))
+      connection.close()
+    for worker in self.workers:
+      worker.join()
@@ -0,0 +1,117 @@
+import heapq
+import threading
+
+class GameEvent(object):
+  """A game event, its payload is available as attributes in the same way as
+  a pygame event's"""
+
+  def __init__(self, game_event, priority=0, **payload):
+    self.game_event = game_event
+    self.priority = priority
+    self.payload = payload
+    self.__dict__.update(payload)
+
+  def update(self, payload):
+    """Replace the payload, used when coalescing"""
+    for key in self.payload:
+      delattr(self, key)
+    self.payload = payload
+    self.__dict__.update(payload)
+
+  def __repr__(self):
+    return "<GameEvent({}, {})>".format(self.game_event, self.payload)
+
+
+class EventBus(object):
+  """Delivers game events within the process, without going through SDL's
+  event queue. Events are delivered in batches, highest priority first then
+  in the order posted. By default events are delivered next frame, events
+  posted same_frame join the batch being delivered. Coalesced event codes are
+  only delivered once per batch, with the payload last posted. Events can be
+  posted from other threads"""
+
+  # Most events delivered by one call to deliver, so events posting events
+  #  can't loop forever. Any more wait for the next frame.
+  MAX_EVENTS_PER_DELIVERY = 1000
+
+  def __init__(self, coalesce=(), payloads=None):
+    self.coalesce = set(coalesce)
+    # Event code -> tuple of payload field names, to check posts against
+    self.payloads = payloads or {}
+    self.lock = threading.Lock()
+    self.sequence = 0
+    # Batches of (-priority, sequence, event) heaps, with the coalesced events
+    #  in each by code
+    self.current = []
+    self.current_coalesced = {}
+    self.next = []
+    self.next_coalesced = {}
+
+  def post(self, code, priority=0, same_frame=False, **payload):
+    """Post an event with a payload of keyword arguments"""
+    if code in self.payloads and set(payload) != set(self.payloads[code]):
+      raise TypeError("Event {} takes payload {}, not {}".format(
+        code, self.payloads[code], tuple(payload)
+      ))
+
+    with self.lock:
+      if same_frame:
+        batch, coalesced = self.current, self.current_coalesced
+      else:
+        batch, coalesced = self.next, self.next_coalesced
+
+      if code in coalesced:
+        # Already waiting in this batch, just update it
+        coalesced[code].update(payload)
+        return
+
+      event = GameEvent(code, priority, **payload)
+      if code in self.coalesce:
+        coalesced[code] = event
+
+      self.sequence += 1
+      heapq.heappush(batch, (-priority, self.sequence, event))
+
+  def next_frame(self):
+    """Start a new frame, events posted for it become the batch to deliver"""
+    with self.lock:
+      # Anything left over from the last batch goes first, having been posted
+      #  earlier. Coalesced events keep the earlier event with the later
+      #  payload.
+      for code, event in self.current_coalesced.items():
+        newer = self.next_coalesced.get(code)
+        if newer:
+          event.update(newer.payload)
+          self.next = [item for item in self.next if item[2] is not newer]
+          heapq.heapify(self.next)
+        self.next_coalesced[code] = event
+      for item in self.current:
+        heapq.heappush(self.next, item)
+
+      self.current, self.current_coalesced = self.next, self.next_coalesced
+      self.next, self.next_coalesced = [], {}
+
+  def pop(self):
+    """Return the next event in the current batch, or None"""
+    with self.lock:
+      if not self.current:
+        return None
+      event = heapq.heappop(self.current)[2]
+      if self.current_coalesced.get(event.game_event) is event:
+        del self.current_coalesced[event.game_event]
+      return event
+
+  def deliver(self, handler):
+    """Call handler with each event of the current batch, including those
+    posted same_frame while delivering"""
+    for i in range(self.MAX_EVENTS_PER_DELIVERY):
+      event = self.pop()
+      if event is None:
+        return
+      handler(event)
+
+  def clear(self):
+    """Drop all undelivered events"""
+    with self.lock:
+      self.current, self.current_coalesced = [], {}
+      self.next, self.next_coalesced = [], {}
@@ -0,0 +1,231 @@
+import pygame
+
+from consts import *
+from objects import Object
+from assets import registry
+
+# NumPy is optional, without it the LevelController falls back to creating
+#  a Car object per car
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+class CarFleet(Object):
+  """Every car in a level at once. Rather than each car being an object, the
+  fleet keeps the cars of its Lanes in NumPy arrays, working out where they
+  all are at a time in a few array operations. Behaves like Car: same lanes,
+  speeds and wrapping. There's only one a level, so it keeps a __dict__
+  rather than listing its many attributes in __slots__"""
+
+  COLLIDABLE = True
+  BATCHED = True
+
+  def __init__(self, controller):
+    super(CarFleet, self).__init__(controller)
+    # Indexes into the list of car images each car uses, by (image_path,
+    #  flipped)
+    self.images = {}
+    self.surfaces = []
+    self.populate([])
+
+  @classmethod
+  def available(cls):
+    """Whether NumPy is installed so a fleet can be used"""
+    return numpy is not None
+
+  def get_car_image(self, image_path, flipped):
+    """Return the index into self.surfaces of the image for a car"""
+    key = (image_path, flipped)
+    if key not in self.images:
+      self.images[key] = len(self.surfaces)
+      self.surfaces.append(registry.get_image(image_path, flip_x=flipped))
+    return self.images[key]
+
+  def populate(self, lanes):
+    """Replace the fleet's cars with those of a list of Lanes"""
+    # Anything drawn last frame will need clearing
+    self.stale_rects = self.get_drawn_rects()
+
+    # One element per car, from its lane
+    def per_car(attribute, dtype):
+      return numpy.array([
+        getattr(lane, attribute) for lane in lanes for k in range(len(lane))
+      ], dtype=dtype)
+
+    self.lanes = lanes
+    self.offset = numpy.array(
+      [offset for lane in lanes for offset in lane.offsets], dtype=float
+    )
+    self.width = per_car('width', int)
+    self.length = per_car('length', float)
+    self.velocity_x = per_car('velocity', float)
+    self.start = per_car('start', float)
+    self.y = per_car('y', int)
+
+    # Images, flipped in right moving lanes
+    self.surface_index = numpy.array([
+      self.get_car_image(image_path, lane.moves_right())
+      for lane in lanes for image_path in lane.image_paths
+    ], dtype=int)
+    sizes = numpy.array(
+      [self.surfaces[i].get_size() for i in self.surface_index], dtype=int
+    ).reshape(-1, 2)
+    self.image_width = sizes[:, 0]
+    self.height = sizes[:, 1]
+
+    # Row -> indexes of the cars covering it, so collision checks only test
+    #  the cars in the rows they ask about
+    row_height = self.controller.engine.collision_index.row_height
+    rows = {}
+    for i, (first, last) in enumerate(zip(
+        (self.y // row_height).tolist(),
+        ((self.y + self.height - 1) // row_height).tolist())):
+      for row in range(first, last + 1):
+        rows.setdefault(row, []).append(i)
+    self.row_cars = dict(
+      (row, numpy.array(cars, dtype=int)) for row, cars in rows.items()
+    )
+
+    # Nothing of the new cars has been drawn yet
+    self.drawn_x = None
+    self.drawn_visible = numpy.zeros(len(self), dtype=bool)
+
+    # The fleet's rect covers every lane it has cars in
+    if len(self):
+      max_width = max(self.width.max(), self.image_width.max())
+      top = self.y.min()
+      self.rect = pygame.Rect(
+        -max_width, top,
+        SCREEN_WIDTH + (max_width * 2), (self.y + self.height).max() - top
+      )
+    else:
+      self.rect = pygame.Rect(0, 0, 0, 0)
+    self.controller.engine.collision_index.update(self)
+
+  def __len__(self):
+    return len(self.offset)
+
+  def tick(self):
+    # Nothing to integrate, positions come from the time when needed
+    pass
+
+  def get_x(self, t, cars=None):
+    """Return every car's position at simulated time t, as Lane.position, or
+    only those of the cars indexed by cars"""
+    if cars is None:
+      cars = slice(None)
+    width = self.width[cars]
+    travelled = self.velocity_x[cars] * (t - self.start[cars])
+    return (self.offset[cars] + width + travelled) % self.length[cars] - width
+
+  def get_draw_x(self, alpha):
+    """Return car positions alpha of the way through the last simulation
+    step, truncated to pixels"""
+    engine = self.controller.engine
+    t = engine.get_ticks() - (1 - alpha) * engine.step_time
+    return self.get_x(t).astype(int)
+
+  def collides(self, rect):
+    """Whether any car's rect overlaps the given rect, only testing the cars
+    in its rows"""
+    first, last = self.controller.engine.collision_index.get_row_span(rect)
+    cars = [self.row_cars[row] for row in range(first, last + 1)
+      if row in self.row_cars]
+    if not cars:
+      return False
+    cars = cars[0] if len(cars) == 1 else numpy.unique(numpy.concatenate(cars))
+
+    x = self.get_x(self.controller.engine.get_ticks(), cars).astype(int)
+    y = self.y[cars]
+    hits = (x < rect.right) & (x + self.width[cars] > rect.left) \
+      & (y < rect.bottom) & (y + self.height[cars] > rect.top)
+    return bool(hits.any())
+
+  def get_rects(self):
+    """Return a collision rect for each car"""
+    x = self.get_x(self.controller.engine.get_ticks())
+    return [
+      pygame.Rect(x, y, w, h) for x, y, w, h in zip(
+        x.astype(int).tolist(), self.y.tolist(),
+        self.width.tolist(), self.height.tolist()
+      )
+    ]
+
+  def get_visible(self, x):
+    """Return a mask of which cars, at positions x, are on screen"""
+    if not self.visible:
+      return numpy.zeros(len(x), dtype=bool)
+    return (x + self.image_width > 0) & (x < SCREEN_WIDTH)
+
+  def get_drawn_rects(self):
+    """Return the rects of the cars drawn last frame"""
+    if getattr(self, 'drawn_x', None) is None:
+      return []
+    mask = self.drawn_visible
+    return self.make_rects(
+      self.drawn_x[mask], self.y[mask], self.image_width[mask], self.height[mask]
+    )
+
+  def make_rects(self, x, y, width, height):
+    """Build a list of rects from arrays of their components"""
+    return [
+      pygame.Rect(*rect) for rect in zip(
+        x.tolist(), y.tolist(), width.tolist(), height.tolist()
+      )
+    ]
+
+  def get_dirty_rects(self, alpha):
+    """Return the regions of the screen changed by cars since last drawn,
+    call before draw_batch"""
+    dirty = self.stale_rects
+    self.stale_rects = []
+
+    x = self.get_draw_x(alpha)
+    visible = self.get_visible(x)
+    if self.drawn_x is None:
+      return dirty + self.make_rects(
+        x[visible], self.y[visible],
+        self.image_width[visible], self.height[visible]
+      )
+
+    # One region covering the old and new position for each car that moved
+    #  a little while on screen. Cars that wrapped get one for each, rather
+    #  than one across the whole screen
+    old_x = self.drawn_x
+    moved = (x != old_x) & (visible | self.drawn_visible)
+    near = moved & (numpy.abs(x - old_x) < self.image_width)
+    left = numpy.minimum(x, old_x)[near]
+    right = numpy.maximum(x, old_x)[near] + self.image_width[near]
+    dirty += self.make_rects(
+      left, self.y[near], right - left, self.height[near]
+    )
+
+    wrapped = moved & ~near
+    for mask, positions in (
+      (wrapped & self.drawn_visible, old_x), (wrapped & visible, x),
+    ):
+      dirty += self.make_rects(
+        positions[mask], self.y[mask], self.image_width[mask], self.height[mask]
+      )
+    return dirty
+
+  def draw_batch(self, alpha):
+    """Return a (surface, rect) pair for each car on screen"""
+    x = self.get_draw_x(alpha)
+    visible = self.get_visible(x)
+    self.drawn_x = x
+    self.drawn_visible = visible
+
+    rects = self.make_rects(
+      x[visible], self.y[visible],
+      self.image_width[visible], self.height[visible]
+    )
+    surfaces = self.surfaces
+    items = [
+      (surfaces[i], rect)
+      for i, rect in zip(self.surface_index[visible].tolist(), rects)
+    ]
+
+    self.drawn_rect = rects[0].unionall(rects) if rects else None
+    return items
@@ -1,9 +1,17 @@
-import sys, pygame
+import os, sys, random, threading, pygame
 from pygame.locals import *
 
 
 from consts import *
 from object_manager import ObjectManagerMixin
+from spatial_index import RowIndex
+from assets import registry
+from audio import bank
+from objects import Object
+from scores import ScoreStore
+from events import EventBus
+from profiler import FrameProfiler
+from tracing import tracer
 
 import controllers
 
@@ -13,15 +21,59 @@ class BaseGameEngine(object):
 class GameEngine(BaseGameEngine, ObjectManagerMixin):
   """Generic 2D game engine"""
   FRAMES_PER_SECOND = 60
+  # The simulation runs in fixed steps, independent of the framerate. If
+  #  frames are slow, at most MAX_STEPS_PER_FRAME are run to catch up.
+  SIMULATION_HZ = 60
+  MAX_STEPS_PER_FRAME = 5
+  # Only redraw and update the regions of the screen that changed each frame,
+  #  rather than compositing and flipping the whole screen
+  DIRTY_RECTS = False
+  # Past this many dirty regions, or this fraction of the screen dirty, it's
+  #  quicker to redraw and flip the whole screen
+  MAX_DIRTY_RECTS = 64
+  MAX_DIRTY_AREA = 0.5
+  # Height of the bands drawn rects are bucketed into, so each dirty region
+  #  is only checked against the objects drawn in its bands
+  DIRTY_BAND_HEIGHT = 32
+
+  # Background images to load and prepare up front
+  BACKGROUNDS = []
+
+  # Game event codes only delivered once a frame, with the latest payload,
+  #  and the payload field names each game event code must be posted with
+  COALESCED_EVENTS = ()
+  # Game events from outside the simulation, such as other threads, which
+  #  replays inject rather than expecting them to happen the same way
+  EXTERNAL_EVENTS = ()
+  EVENT_PAYLOADS = {}
+
+  def __init__(self, headless=False, render=None, seed=None):
+    """A headless engine has no window or audio output, takes its input only
+    from feed_event and runs on simulated time as fast as it can be ticked.
+    render controls whether objects are drawn, by default only when not
+    headless. Game randomness comes from the engine's own random, seeded with
+    seed, so engines sharing a process don't affect each other"""
+    super(GameEngine, self).__init__()
 
-  active_controllers = []
-  capture_text = False
+    self.active_controllers = []
+    self.capture_text = False
+    self.random = random.Random(seed)
 
-  def __init__(self):
-    super(GameEngine, self).__init__()
+    self.headless = headless
+    self.render = not headless if render is None else render
+
+    if headless:
+      # SDL's dummy drivers give us a display surface to convert images
+      #  against without opening a window or an audio device
+      os.environ['SDL_VIDEODRIVER'] = 'dummy'
+      os.environ['SDL_AUDIODRIVER'] = 'dummy'
 
     pygame.init()
 
+    if headless:
+      # No sound at all, the sound bank skips playing anything
+      pygame.mixer.quit()
+
     # Set up the screen
     self.screen = pygame.display.set_mode(
       (SCREEN_WIDTH, SCREEN_HEIGHT)
@@ -31,44 +83,114 @@ class GameEngine(BaseGameEngine, ObjectManagerMixin):
     pygame.display.flip()
 
     # Set the application icon
-    self.icon = pygame.image.load('images/{}'.format(self.ICON)).convert_alpha()
+    self.icon = registry.get_image(self.ICON)
     pygame.display.set_icon(self.icon)
 
     # Set up the surfaces
     self.background_surface = self.get_screen_sized_surface()
     self.foreground_surface = self.get_screen_sized_surface()
 
+    # Prepared backgrounds by image path, and the one in use if the
+    #  background surface is currently one of those shared surfaces
+    self.backgrounds = {}
+    self.background_image = None
+    if self.render:
+      for image_path in self.BACKGROUNDS:
+        self.get_background(image_path)
+
+    # Regions of the screen to be redrawn next frame when using DIRTY_RECTS,
+    #  a full redraw is needed for the first frame and after background changes
+    self.dirty_rects = []
+    self.full_redraw = True
+
+    # Index of collidable objects by the rows they cover
+    self.collision_index = RowIndex()
+
     # Set up the clock
     self.clock = pygame.time.Clock()
 
+    # Simulated time, advanced in fixed steps of step_time ms. The
+    #  accumulator holds real time passed that hasn't been simulated yet.
+    self.step_time = 1000.0 / self.SIMULATION_HZ
+    self.simulated_time = 0
+    self.accumulator = 0
+    self.last_tick = self.step_time
+
+    # When set, each frame runs exactly this many steps, used by replays
+    self.frame_steps = None
+
+    # Told of input, game events and frames when recording or replaying
+    self.recorder = None
+
+    # Events waiting for the next tick when headless, as there's no SDL
+    #  event queue to read from. Events can be fed from other threads.
+    self.pending_events = []
+    self.pending_events_lock = threading.Lock()
+
     # Keep alive, program should terminate when False
     self.keep_alive = True
 
+    # Per phase frame timings, off until enabled
+    self.profiler = FrameProfiler()
+
+    # Game events, delivered in process rather than through SDL
+    self.events = EventBus(self.COALESCED_EVENTS, self.EVENT_PAYLOADS)
+
+    # Key or game event code -> list of (controller, handler) bound to it,
+    #  rebuilt whenever the active controllers change
+    self.dispatch_table = {}
+
     # Setup initial state
     self.setup_state(self.STARTING_STATE)
 
   def get_ticks(self):
-    # Can be got globally, but asking the engine for this feels nicer
-    return pygame.time.get_ticks()
+    # Game time is simulated time, so the game plays the same however fast
+    #  frames are drawn
+    return self.simulated_time
 
   def get_fps(self):
     """Return the framerate, computed from last 10 clocks"""
-    return int(self.clock.get_fps())
+    fps = self.clock.get_fps()
+    # Uncapped headless frames can be quicker than the clock can measure
+    return int(fps) if fps != float('inf') else 0
 
   def create_controller(self, controller, messages):
     """Create a controller and append to the active_controllers list"""
     # Pass a reference to self, the engine, and any messages for this state change
     new_controller = controller(self, messages)
     self.active_controllers.append(new_controller)
+    new_controller.active = True
+    self.build_dispatch_table()
 
   def destroy_controller(self, controller):
     """Remove a controller from the active state, calling that controller's
     destroy method"""
     controller.destroy()
     self.active_controllers.remove(controller)
+    controller.active = False
+    self.build_dispatch_table()
+
+  def build_dispatch_table(self):
+    """Map each key and game event code to the handlers of the active
+    controllers bound to it, in controller order"""
+    table = {}
+    for controller in self.active_controllers:
+      for code, handler in controller.EVENT_BINDINGS.items():
+        table.setdefault(code, []).append((controller, handler))
+    self.dispatch_table = table
+
+  def dispatch(self, code, *args):
+    """Call the handlers bound to an event code. Handlers of controllers
+    destroyed by an earlier handler, such as by a state change, are skipped"""
+    for controller, handler in self.dispatch_table.get(code, ()):
+      if controller.active:
+        # Argument needed here to satisfy the need for self within method
+        handler(controller, *args)
 
   def setup_state(self, state, purge=False, messages={}):
     """Remove old controllers, start a new state's controllers"""
+    start = tracer.now()
+
     # Add the requested state into the messages dict
     messages["state"] = state
 
@@ -83,24 +205,32 @@ class GameEngine(BaseGameEngine, ObjectManagerMixin):
       if controller.__class__ not in new_controllers or purge:
         self.destroy_controller(controller)
 
-    # Add controllers not already running
+    # Add controllers not already running, in the state's order so the game
+    #  plays the same way every time
     active_controller_classes = [c.__class__ for c in self.active_controllers]
-    for controller in set(new_controllers) - set(active_controller_classes):
-      self.create_controller(controller, messages)
+    for controller in new_controllers:
+      if controller not in active_controller_classes:
+        self.create_controller(controller, messages)
+
+    tracer.complete('setup_state', start, category='state',
+      args={'state': state, 'purge': purge})
 
   def purge_controllers(self):
     """Destroy all controllers"""
-    for controller in self.active_controllers:
+    # Copied, destroying a controller removes it from active_controllers
+    for controller in list(self.active_controllers):
       self.destroy_controller(controller)
 
   def event_handle(self, event):
     """Handle a single event"""
-    if hasattr(event, 'key') and event.type == KEYDOWN:
+    if event.type == KEYDOWN:
       # Global key binding to quit things, set keep_alive to false to trigger
       #  quitting at the end of the current tick
 
       if event.key == K_ESCAPE: self.keep_alive = False
-      if event.key == K_F12: pygame.display.toggle_fullscreen()
+      if event.key == K_F12:
+        pygame.display.toggle_fullscreen()
+        self.full_redraw = True
 
       # Debug commands
       if event.key == K_o: print self.objects # Print all active objects
@@ -110,34 +240,50 @@ class GameEngine(BaseGameEngine, ObjectManagerMixin):
       if event.key == K_m: self.post_event(E_DIE) # Debug make win state
 
       # Run event bindings in all the active controllers
-      for controller in self.active_controllers:
-        if event.key in controller.EVENT_BINDINGS:
-          # Argument needed here to satisfy the need for self within method
-          controller.EVENT_BINDINGS[event.key](controller)
-
-    elif hasattr(event, 'game_event'):
-      # Controller events
-      for controller in self.active_controllers:
-        if event.game_event in controller.EVENT_BINDINGS:
-          controller.EVENT_BINDINGS[event.game_event](controller, event)
+      self.dispatch(event.key)
 
     elif event.type == pygame.QUIT:
       # Respond to the window manager's close button and all other cases of
       #  being asked to quit
       self.keep_alive = False
 
+  def get_events(self):
+    """Return the events that have arrived since the last tick"""
+    if self.headless:
+      with self.pending_events_lock:
+        events = self.pending_events
+        self.pending_events = []
+    else:
+      events = pygame.event.get()
+
+    if self.recorder:
+      self.recorder.on_input(events)
+    return events
+
+  def feed_event(self, event):
+    """Queue a pygame event, such as a KEYDOWN, as if it came from the user"""
+    if self.headless:
+      with self.pending_events_lock:
+        self.pending_events.append(event)
+    else:
+      pygame.event.post(event)
+
   def text_capture(self):
-    for event in pygame.event.get():
+    for event in self.get_events():
       if event.type == KEYDOWN:
-        for controller in self.active_controllers:
-          if E_TEXT_CAPTURE in controller.EVENT_BINDINGS:
-            # Argument needed here to satisfy the need for self within method
-            controller.EVENT_BINDINGS[E_TEXT_CAPTURE](controller, event)
+        self.dispatch(E_TEXT_CAPTURE, event)
 
   def post_event(self, event, **kwargs):
-    """Post a game event"""
-    ev = pygame.event.Event(pygame.USEREVENT, game_event = event, **kwargs)
-    pygame.event.post(ev)
+    """Post a game event, see EventBus.post for the options"""
+    self.events.post(event, **kwargs)
+
+  def game_event_handle(self, event):
+    """Handle a single game event"""
+    if self.recorder and not self.recorder.on_game_event(event):
+      return
+
+    # Controller events
+    self.dispatch(event.game_event, event)
 
   def get_screen_sized_surface(self):
     """Return a pygame screen sized surface with a transparent background"""
@@ -152,12 +298,41 @@ class GameEngine(BaseGameEngine, ObjectManagerMixin):
 
   def clear_background(self):
     """Clear the background surface"""
+    self.own_background()
     self.background_surface.fill(BLACK)
 
+  def get_background(self, image_path):
+    """Return an opaque, display format, screen sized surface showing a
+    background image. Prepared once per image then shared"""
+    if image_path not in self.backgrounds:
+      image = registry.get_image(image_path, alpha=False)
+      if image.get_size() == (self.SCREEN_WIDTH, self.SCREEN_HEIGHT):
+        background = image
+      else:
+        background = pygame.Surface(
+          (self.SCREEN_WIDTH, self.SCREEN_HEIGHT)
+        ).convert()
+        background.fill(BLACK)
+        background.blit(image, ORIGIN)
+      self.backgrounds[image_path] = background
+    return self.backgrounds[image_path]
+
   def set_background_image(self, image_path):
     """Fill the background with an image given its path"""
-    bg_surf = pygame.image.load('images/{}'.format(image_path))
-    self.background_blit(bg_surf, ORIGIN)
+    if not self.render or image_path == self.background_image:
+      # Nothing to draw, or already showing this background
+      return
+
+    self.background_surface = self.get_background(image_path)
+    self.background_image = image_path
+    self.full_redraw = True
+
+  def own_background(self):
+    """Make sure the background surface isn't a shared prepared background
+    before drawing on it, copying it if it is"""
+    if self.background_image:
+      self.background_surface = self.background_surface.copy()
+      self.background_image = None
 
   def foreground_blit(self, surface, coord):
     """Draw a pygame surface to the foreground"""
@@ -165,50 +340,237 @@ class GameEngine(BaseGameEngine, ObjectManagerMixin):
 
   def background_blit(self, surface, coord):
     """Draw a pygame surface to the background"""
+    self.own_background()
     self.background_surface.blit(surface, coord)
-
-  def tick(self):
-    """Main game loop"""
-    # Tick the clock
-    self.last_tick = self.clock.tick(self.FRAMES_PER_SECOND)
-
-    # Events
-    if self.capture_text:
-      self.text_capture()
-    else:
-      for event in pygame.event.get(): self.event_handle(event)
-
+    self.full_redraw = True
+
+  def remove_object(self, obj):
+    """Remove an object, dropping it from the collision index and marking
+    where it was drawn as needing a redraw"""
+    super(GameEngine, self).remove_object(obj)
+    self.collision_index.remove(obj)
+    if obj.drawn_rect:
+      self.dirty_rects.append(obj.drawn_rect)
+
+  def draw_full(self, alpha):
+    """Composite all objects onto the background and flip the whole screen.
+    Objects are drawn alpha of the way between the last two steps"""
     # Clear the foreground
     self.clear_foreground()
 
-    # Controller actions
-    for controller in self.active_controllers: controller.tick()
-
-    # Sort objects by Z_INDEX
-    self.objects.sort(key = lambda obj: obj.Z_INDEX)
-
-    # Draw active objects to the foreground
-    for obj in self.objects:
+    # Draw active objects to the foreground, in Z_INDEX order
+    for obj in self.objects_by_z_index():
       # Cancel if object is set not to be drawn
       if not obj.visible: continue
 
+      if obj.BATCHED:
+        for surface, rect in obj.draw_batch(alpha):
+          self.foreground_blit(surface, rect)
+        continue
+
       obj_surface = obj.draw()
       if obj_surface:
-        self.foreground_blit(obj_surface, obj.pos)
+        self.foreground_blit(obj_surface, obj.get_draw_pos(alpha))
+    self.profiler.mark('draw')
 
     self.screen.blit(self.background_surface, ORIGIN)
     self.screen.blit(self.foreground_surface, ORIGIN)
+    self.profiler.mark('composite')
 
     # Flip the screen
     pygame.display.flip()
+    self.profiler.mark('flip')
+
+  def draw_dirty(self, alpha):
+    """Redraw only the regions of the screen covered by objects that moved,
+    changed or disappeared since the last frame, then update just those.
+    Objects are drawn alpha of the way between the last two steps"""
+    dirty = self.dirty_rects
+    self.dirty_rects = []
+
+    # Work out what each object looks like this frame, compared to last frame
+    drawn = []
+    for obj in self.objects_by_z_index():
+      if obj.BATCHED:
+        # Batched objects keep track of their own changes
+        dirty.extend(obj.get_dirty_rects(alpha))
+        drawn.extend(obj.draw_batch(alpha))
+        continue
+
+      surface = obj.draw() if obj.visible else None
+      rect = surface.get_rect(topleft=obj.get_draw_pos(alpha)) if surface else None
+      old_rect = obj.drawn_rect
+
+      if surface is not obj.drawn_surface or rect != old_rect:
+        if old_rect and rect and old_rect.colliderect(rect):
+          # Moved a little, one region covers both old and new
+          dirty.append(old_rect.union(rect))
+        else:
+          if old_rect: dirty.append(old_rect)
+          if rect: dirty.append(rect)
+
+      obj.drawn_rect = rect
+      obj.drawn_surface = surface
+      if surface:
+        drawn.append((surface, rect))
+    self.profiler.mark('draw')
+
+    dirty = self.merge_regions(dirty)
+    area = sum(region.width * region.height for region in dirty)
+    if self.full_redraw or len(dirty) > self.MAX_DIRTY_RECTS \
+        or area > self.MAX_DIRTY_AREA * self.screen.get_width() \
+          * self.screen.get_height():
+      # Background changed or too much moved, redraw everything
+      self.full_redraw = False
+      self.screen.blit(self.background_surface, ORIGIN)
+      for surface, rect in drawn:
+        self.screen.blit(surface, rect)
+      self.profiler.mark('composite')
+      pygame.display.flip()
+      self.profiler.mark('flip')
+      return
+
+    if not dirty: return
+
+    # Indexes into drawn of the rects in each band, in draw order
+    bands = {}
+    for i, (surface, rect) in enumerate(drawn):
+      for band in self.get_bands(rect):
+        bands.setdefault(band, []).append(i)
+
+    # Restore each region from the background and redraw, in order, the
+    #  objects overlapping it. Clipping stops us compositing an object over
+    #  itself outside the region.
+    for region in dirty:
+      self.screen.set_clip(region)
+      self.screen.blit(self.background_surface, region, region)
+      candidates = set()
+      for band in self.get_bands(region):
+        candidates.update(bands.get(band, ()))
+      for i in sorted(candidates):
+        surface, rect = drawn[i]
+        if region.colliderect(rect):
+          self.screen.blit(surface, rect)
+    self.screen.set_clip(None)
+    self.profiler.mark('composite')
+
+    pygame.display.update(dirty)
+    self.profiler.mark('flip')
+
+  def get_bands(self, rect):
+    """Return the DIRTY_BAND_HEIGHT bands of the screen a rect covers"""
+    return range(
+      max(rect.top, 0) // self.DIRTY_BAND_HEIGHT,
+      (min(rect.bottom, self.screen.get_height()) - 1)
+        // self.DIRTY_BAND_HEIGHT + 1
+    )
+
+  def merge_regions(self, regions):
+    """Merge regions that overlap the one before them, top to bottom, so
+    objects moving a little aren't redrawn once per region"""
+    merged = []
+    for region in sorted(regions, key=lambda rect: (rect.top, rect.left)):
+      if merged and merged[-1].colliderect(region):
+        merged[-1] = merged[-1].union(region)
+      else:
+        merged.append(region)
+    return merged
+
+  def tick(self):
+    """Main game loop"""
+    self.profiler.start_frame()
+
+    # Tick the clock
+    if self.frame_steps is not None:
+      # Half a step over, so rounding can't lose one
+      self.clock.tick()
+      self.accumulator = (self.frame_steps + 0.5) * self.step_time
+    elif self.headless:
+      # Uncapped, but always run exactly one step of simulated time
+      self.clock.tick()
+      self.accumulator += self.step_time
+    else:
+      self.accumulator += self.clock.tick(self.FRAMES_PER_SECOND)
+    self.profiler.mark('wait')
+
+    # Events
+    if self.capture_text:
+      self.text_capture()
+    else:
+      for event in self.get_events(): self.event_handle(event)
+
+    # Game events posted last frame
+    self.events.next_frame()
+    self.events.deliver(self.game_event_handle)
+    self.profiler.mark('events')
+
+    # Simulate in fixed steps until caught up with the time passed. If we've
+    #  fallen too far behind drop the extra time, the game slows down rather
+    #  than spending ever longer catching up
+    steps = 0
+    while self.accumulator >= self.step_time:
+      if steps == self.MAX_STEPS_PER_FRAME:
+        self.accumulator %= self.step_time
+        break
+      self.step()
+      self.accumulator -= self.step_time
+      steps += 1
+
+    # Game events posted for this frame by the steps
+    self.events.deliver(self.game_event_handle)
+    self.profiler.mark('events')
+
+    # Draw objects and update the display, part way between the last two
+    #  steps for the time left over in the accumulator
+    alpha = self.accumulator / self.step_time
+    if not self.render:
+      pass
+    elif self.DIRTY_RECTS:
+      self.draw_dirty(alpha)
+    else:
+      self.draw_full(alpha)
+
+    self.profiler.end_frame()
+
+    if self.recorder:
+      self.recorder.on_frame(steps)
 
     # If we are going to quit, call the quit method
     if not self.keep_alive: self.quit()
 
+  def step(self):
+    """Advance the simulation by one fixed step"""
+    self.last_tick = self.step_time
+
+    # Controller actions
+    if self.profiler.is_active():
+      # Timed separately, by controller class
+      for controller in self.active_controllers:
+        controller.tick()
+        self.profiler.mark(controller.__class__)
+    else:
+      for controller in self.active_controllers: controller.tick()
+
+    self.simulated_time += self.step_time
+
+  def run(self, frames=None):
+    """Tick until the game quits, or for a number of frames. Returns the
+    number of frames run"""
+    frame = 0
+    while self.keep_alive and (frames is None or frame < frames):
+      self.tick()
+      frame += 1
+    return frame
+
   def quit(self):
     """Quit the game"""
     print "Game engine quitting"
     self.purge_controllers()
+    # Cached surfaces, fonts and sounds don't survive pygame quitting, drop
+    #  them so another engine in this process loads its own
+    registry.clear()
+    Object.class_images.clear()
+    bank.clear()
     pygame.quit()
 
 
@@ -221,6 +583,10 @@ class FroggerGameEngine(GameEngine):
 
   ICON = CHICKEN
 
+  BACKGROUNDS = [BG_MENU, BG_GAME, BG_GAME_OVER, BG_SCORE_BOARD]
+
+  DIRTY_RECTS = True
+
   STATES = {
     'menu': [
       controllers.MenuController,
@@ -248,3 +614,55 @@ class FroggerGameEngine(GameEngine):
   }
 
   STARTING_STATE = 'menu'
+
+  COALESCED_EVENTS = (E_SCORE_CHANGED, E_LEVEL_CHANGED)
+  # Posted by the score writer thread
+  EXTERNAL_EVENTS = (E_SCORE_SAVED, E_SCORE_SAVE_FAILED)
+  EVENT_PAYLOADS = {
+    E_WIN: (),
+    E_DIE: (),
+    E_SOFT_RESET: ('level', 'lives', 'score'),
+    E_HOP: ('direction', 'progress'),
+    E_SCORE_CHANGED: ('score',),
+    E_DISABLE_MOVEMENT: (),
+    E_ENABLE_MOVEMENT: (),
+    E_SCORE_SAVED: ('name',),
+    E_SCORE_SAVE_FAILED: ('name',),
+    E_LEVEL_CHANGED: ('level',),
+  }
+
+  # High scores, imported from the old CSV file on first run
+  SCORE_DB = "high_scores.db"
+  SCORE_CSV = "high_score.csv"
+
+  score_store = None
+
+  def get_score_store(self):
+    """Return the high score store, opening it the first time"""
+    if self.score_store is None:
+      self.score_store = ScoreStore(self.SCORE_DB, self.SCORE_CSV)
+    return self.score_store
+
+  def quit(self):
+    # Make sure any scores still being written are saved
+    if self.score_store:
+      self.score_store.close()
+    super(FroggerGameEngine, self).quit()
+
+
+class AutoplayGameEngine(FroggerGameEngine):
+  """The game played by the AutoPlayerController, for soak tests and attract
+  mode. Starts straight into a game and restarts after a game over, without
+  asking for a name or saving the score"""
+
+  STATES = dict(FroggerGameEngine.STATES,
+    game=[controllers.AutoPlayerController] + FroggerGameEngine.STATES['game'],
+    gameover=[
+      controllers.GameController,
+      controllers.GameOverController,
+      controllers.FPSCounterController,
+      controllers.AutoPlayerController,
+    ],
+  )
+
+  STARTING_STATE = 'game'
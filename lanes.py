@@ -0,0 +1,60 @@
+from consts import *
+from characters import Car
+
+class Lane(object):
+  """A lane of cars all driving at the same speed round a loop, from just off
+  the left of the screen to just off the right, reappearing on the other side
+  once fully off screen. Cars can start further off the right than the
+  screen is wide, so the loop is made long enough for all of them with at
+  least CAR_SPACING after the last. Where each car is is worked out from the
+  simulated time rather than integrated each step, so it can be asked of any
+  time, past or far in the future, without drifting"""
+
+  def __init__(self, index, width, velocity, offsets, image_paths, start=0):
+    # Lanes are numbered up from the bottom of the road
+    self.index = index
+    self.y = Car.LANE_ORIGIN - (Car.LANE_HEIGHT * index)
+    self.width = width
+    # Pixels per ms, negative moving left
+    self.velocity = velocity
+    # Position of each car at the start time, and the image it's drawn with
+    self.offsets = offsets
+    self.image_paths = image_paths
+    self.start = start
+    self.length = max(
+      SCREEN_WIDTH + width, max(offsets or [0]) + Car.CAR_SPACING
+    )
+
+  @staticmethod
+  def get_velocity(index, level, speed_multiplier):
+    """Return the velocity of a lane's cars, right moving in odd lanes"""
+    speed = Car.SPEED + (Car.SPEED_INCREMENT * (level + 1) * speed_multiplier)
+    return speed if index % 2 else -speed
+
+  def __len__(self):
+    return len(self.offsets)
+
+  def moves_right(self):
+    return self.velocity > 0
+
+  def position(self, k, t):
+    """Return the x of car k at simulated time t"""
+    travelled = self.velocity * (t - self.start)
+    return (self.offsets[k] + self.width + travelled) % self.length - self.width
+
+  def positions(self, t):
+    """Return the x of every car at simulated time t"""
+    travelled = self.velocity * (t - self.start)
+    return [
+      (offset + self.width + travelled) % self.length - self.width
+      for offset in self.offsets
+    ]
+
+  def overlaps(self, left, right, t):
+    """Whether a car covers any of left to right at simulated time t"""
+    width = self.width
+    return any(x < right and x + width > left for x in self.positions(t))
+
+  def occupied(self, x, t):
+    """Whether a car covers x at simulated time t"""
+    return self.overlaps(x, x + 1, t)
@@ -1,16 +1,97 @@
 # Main game script
 
-from game import FroggerGameEngine
+import os
+import shutil
+import argparse
+import tempfile
+import time
+
+from game import FroggerGameEngine, AutoplayGameEngine
+from tracing import tracer
+from replay import Recorder, Replayer
+
+def parse_args():
+  parser = argparse.ArgumentParser(description="Why Did The Chicken Cross The Road?")
+  parser.add_argument('--headless', action='store_true',
+    help="run without a window or audio, as fast as possible")
+  parser.add_argument('--render', action='store_true',
+    help="still draw each frame when headless")
+  parser.add_argument('--frames', type=int, default=None,
+    help="stop after this many frames")
+  parser.add_argument('--trace', metavar='PATH',
+    default=os.environ.get('FROGGER_TRACE'),
+    help="record a Chrome trace of the engine to PATH, also set by the "
+      "FROGGER_TRACE environment variable")
+  parser.add_argument('--autoplay', action='store_true',
+    help="let the computer play, restarting after each game over")
+  parser.add_argument('--record', metavar='PATH',
+    help="record the session to PATH so it can be replayed")
+  parser.add_argument('--replay', metavar='PATH',
+    help="replay a recorded session headless, checking it plays the same")
+  return parser.parse_args()
 
 if __name__ == "__main__":
+  args = parse_args()
+
+  if args.trace:
+    # Start before the engine so its set up is traced too
+    tracer.start(args.trace)
+
+  recorder = Recorder(args.record) if args.record else None
+  replayer = Replayer(args.replay) if args.replay else None
+  if replayer:
+    args.headless = True
+
   print "Starting game..."
-  engine = FroggerGameEngine()
+  engine_class = AutoplayGameEngine if args.autoplay else FroggerGameEngine
+  engine = engine_class(
+    headless=args.headless,
+    render=True if args.render else None,
+  )
+
+  if recorder:
+    recorder.attach(engine)
+
+  if replayer:
+    # Scores saved in the replay go in a database of their own rather than
+    #  joining the player's
+    score_dir = tempfile.mkdtemp()
+    engine.SCORE_DB = os.path.join(score_dir, "replay_scores.db")
+    engine.SCORE_CSV = None
 
   # Main game loop, tick uses pygame.time.Clock to make this loop run at a
-  #  sensible speed
-  while engine.keep_alive:
-    engine.tick()
+  #  sensible speed, unless headless where it runs flat out
+  start = time.time()
+  if replayer:
+    frames = replayer.run(engine, args.frames)
+  else:
+    frames = engine.run(args.frames)
+  elapsed = time.time() - start
 
-  print "Game ended gracefully"
+  if engine.keep_alive:
+    # Stopped by the frame limit rather than the game, so quit properly
+    engine.quit()
+
+  if recorder:
+    recorder.close()
+    print "Recording written to {}".format(args.record)
 
+  if replayer:
+    shutil.rmtree(score_dir)
+    if replayer.diverged_frame is None:
+      print "Replay matched the recording"
+    else:
+      print "Replay diverged at frame {}, expected game events {}".format(
+        replayer.diverged_frame, replayer.expected_events
+      )
 
+  if args.trace:
+    tracer.stop()
+    print "Trace written to {}".format(args.trace)
+
+  if args.headless:
+    print "Ran {} frames in {:.2f}s ({:.0f} fps)".format(
+      frames, elapsed, frames / elapsed if elapsed else 0
+    )
+
+  print "Game ended gracefully"
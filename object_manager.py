@@ -1,9 +1,120 @@
+from bisect import insort
+
+class SlotList(object):
+  """An ordered collection with O(1) add and remove. Removed items leave an
+  empty slot behind rather than shuffling the rest along, slots are compacted
+  once at least half of them are empty. Iterating works on a snapshot, so
+  items can be removed while looping"""
+
+  # Don't bother compacting lists with fewer empty slots than this
+  MIN_COMPACT_HOLES = 16
+
+  def __init__(self, items=()):
+    # Items in the order added, None in empty slots
+    self.slots = []
+    # Item -> index of its slot
+    self.positions = {}
+    self.holes = 0
+    for item in items:
+      self.add(item)
+
+  def add(self, item):
+    self.positions[item] = len(self.slots)
+    self.slots.append(item)
+
+  def remove(self, item):
+    """Remove an item, raises ValueError if it isn't in the list"""
+    try:
+      position = self.positions.pop(item)
+    except KeyError:
+      raise ValueError("{!r} not in list".format(item))
+    self.slots[position] = None
+    self.holes += 1
+
+    if self.holes >= self.MIN_COMPACT_HOLES and self.holes * 2 >= len(self.slots):
+      self.compact()
+
+  def compact(self):
+    """Drop the empty slots"""
+    self.slots = [item for item in self.slots if item is not None]
+    self.positions = dict((item, i) for i, item in enumerate(self.slots))
+    self.holes = 0
+
+  def __iter__(self):
+    if self.holes:
+      return iter([item for item in self.slots if item is not None])
+    return iter(list(self.slots))
+
+  def __len__(self):
+    return len(self.positions)
+
+  def __nonzero__(self):
+    return bool(self.positions)
+  __bool__ = __nonzero__
+
+  def __contains__(self, item):
+    return item in self.positions
+
+  def __repr__(self):
+    return repr(list(self))
+
+
+class ObjectRegistry(SlotList):
+  """SlotList of objects, also indexed by class and by owning controller, so
+  finding or purging the objects of a type or owner only costs as much as
+  the objects found"""
+
+  def __init__(self, items=()):
+    # Class -> SlotList of objects of exactly that class
+    self.by_class = {}
+    # Controller -> SlotList of objects it created
+    self.by_owner = {}
+    super(ObjectRegistry, self).__init__(items)
+
+  def add(self, obj):
+    super(ObjectRegistry, self).add(obj)
+    self.by_class.setdefault(obj.__class__, SlotList()).add(obj)
+    self.by_owner.setdefault(obj.controller, SlotList()).add(obj)
+
+  def remove(self, obj):
+    super(ObjectRegistry, self).remove(obj)
+    self.remove_from_index(self.by_class, obj.__class__, obj)
+    self.remove_from_index(self.by_owner, obj.controller, obj)
+
+  def remove_from_index(self, index, key, obj):
+    """Remove obj from an index's SlotList, dropping the list once empty"""
+    objects = index[key]
+    objects.remove(obj)
+    if not objects:
+      del index[key]
+
+  def of_type(self, by_type):
+    """Return a list of the objects that are instances of by_type"""
+    found = []
+    for cls, objects in self.by_class.items():
+      if issubclass(cls, by_type):
+        found.extend(objects)
+    return found
+
+  def owned_by(self, owner):
+    """Return a list of the objects created by owner"""
+    return list(self.by_owner.get(owner, ()))
+
+
 class ObjectManagerMixin(object):
   """Provides a mechanism for managing objects owned by the class. Passes
   created and destroyed objects to a 'parent class' so it can keep track too"""
 
   def __init__(self):
-    self.objects = []
+    self.objects = ObjectRegistry()
+
+    # Objects bucketed by Z_INDEX, with the Z_INDEXes in use kept sorted, so
+    #  objects can be walked in draw order without sorting every frame
+    self.render_layers = {}
+    self.render_order = []
+
+    # Released objects waiting to be reused, by class
+    self.object_pools = {}
 
   def create_object(self, obj, *args, **kwargs):
     """Add an object to current state and returns the instance"""
@@ -16,8 +127,14 @@ class ObjectManagerMixin(object):
     return new_obj_instance
 
   def add_object(self, inst):
-    """Given an object instance, append to object list"""
-    self.objects.append(inst)
+    """Given an object instance, add it to the object registry"""
+    self.objects.add(inst)
+
+    z_index = inst.Z_INDEX
+    if z_index not in self.render_layers:
+      self.render_layers[z_index] = SlotList()
+      insort(self.render_order, z_index)
+    self.render_layers[z_index].add(inst)
 
   def destroy_object(self, obj):
     """Removes object from current state"""
@@ -33,21 +150,63 @@ class ObjectManagerMixin(object):
     # print self.objects, obj
     self.objects.remove(obj)
 
+    layer = self.render_layers[obj.Z_INDEX]
+    layer.remove(obj)
+    if not layer:
+      del self.render_layers[obj.Z_INDEX]
+      self.render_order.remove(obj.Z_INDEX)
+
   def purge_objects(self, by_type=None):
     """Deletes all objects, optionally only delete objects of a certain type"""
     if by_type:
-      # If type specified, filter the object list by this type
-      objects_to_purge = filter(
-        lambda obj: isinstance(obj, by_type), self.objects
-      )
+      # If type specified, only look at objects of this type
+      objects_to_purge = self.objects.of_type(by_type)
     else:
-      # Make a copy of objects. This needs doing as looping over a list
-      # while removing items from that list causes the for loop to mis-index.
       objects_to_purge = list(self.objects)
 
     for obj in objects_to_purge:
       self.destroy_object(obj)
 
+  def acquire_object(self, obj, *args, **kwargs):
+    """Like create_object, but reuses a released object of the class if there
+    is one, re-initialising it through its create method. Objects are owned
+    by us, args and kwargs are those taken by create"""
+    pool = self.object_pools.get(obj)
+    if not pool:
+      return self.create_object(obj, self, *args, **kwargs)
+
+    inst = pool.pop()
+    inst.recycle(*args, **kwargs)
+    self.add_object(inst)
+
+    if hasattr(self, 'object_super'):
+      self.object_super.add_object(inst)
+
+    return inst
+
+  def release_object(self, obj):
+    """Remove an object like destroy_object, but keep it for acquire_object
+    to reuse"""
+    self.destroy_object(obj)
+    self.object_pools.setdefault(obj.__class__, []).append(obj)
+
+  def release_objects(self, by_type=None):
+    """Release all objects, optionally only objects of a certain type"""
+    if by_type:
+      objects_to_release = self.objects.of_type(by_type)
+    else:
+      objects_to_release = list(self.objects)
+
+    for obj in objects_to_release:
+      self.release_object(obj)
+
+  def objects_by_z_index(self):
+    """Yield objects in draw order, lowest Z_INDEX first. Objects sharing a
+    Z_INDEX come out in the order they were added"""
+    for z_index in self.render_order:
+      for obj in self.render_layers[z_index]:
+        yield obj
+
   def tick_objects(self):
     """Run tick function on all objects"""
     for obj in self.objects:
@@ -2,11 +2,31 @@ import pygame
 from pygame.locals import *
 
 from consts import *
+from assets import registry
 
 class Object(object):
-  """Generic object, a thing with a position that's drawn to the screen"""
+  """Generic object, a thing with a position that's drawn to the screen.
+  Objects keep their attributes in __slots__ rather than a __dict__, as
+  levels can hold a great many of them, so subclasses list any attributes
+  they add in their own __slots__"""
+
+  __slots__ = (
+    'controller', 'pos', 'rect', 'visible', 'drawn_rect', 'drawn_surface',
+  )
+
   PLACEHOLDER_COLOUR = YELLOW
   Z_INDEX = 0
+  # Collidable objects are kept in the engine's collision_index so they can
+  #  be found by CollisionDetectionMixin
+  COLLIDABLE = False
+  # Batched objects draw many surfaces, through draw_batch, instead of one
+  BATCHED = False
+  # Image every object of the class is drawn with, loaded once for all of
+  #  them. Objects with an image of their own add an image slot
+  IMAGE = None
+  image = None
+  # Class -> its IMAGE surface, once loaded
+  class_images = {}
 
   def __init__(self, controller, pos=(0,0)):
     # Set instance variables
@@ -15,23 +35,35 @@ class Object(object):
     self.rect = pygame.Rect(pos, (GRID, GRID))
     self.visible = True
 
-  def get_image(self, image_path=None):
-    """Load in a image surface or return the cached one"""
-    if hasattr(self, 'image'):
-      # Image already loaded, return it
+    # Where and what the engine last drew for this object, used by dirty rect
+    #  rendering to work out which regions of the screen need redrawing
+    self.drawn_rect = None
+    self.drawn_surface = None
+
+  def create(self, pos=None):
+    """Set up the object, called again when a pooled object is reused.
+    Override to take other arguments"""
+    if pos is not None:
+      self.pos = pos
+
+  def recycle(self, *args, **kwargs):
+    """Reset a released object for reuse, passing arguments on to create"""
+    self.visible = True
+    self.drawn_rect = None
+    self.drawn_surface = None
+    self.create(*args, **kwargs)
+
+  def get_image(self):
+    """Return the object's own image if it has one, otherwise its class's
+    IMAGE, loaded the first time any object of the class asks"""
+    if self.image is not None:
       return self.image
-    elif image_path:
-      # Provided image path
-      selected_image_path = image_path
-    elif hasattr(self, 'IMAGE'):
-      # Class has IMAGE const
-      selected_image_path = self.IMAGE
-    else:
-      # No image path
-      return None
 
-    self.image = pygame.image.load('images/{}'.format(selected_image_path)).convert_alpha()
-    return self.image
+    cls = self.__class__
+    image = Object.class_images.get(cls)
+    if image is None and self.IMAGE:
+      image = Object.class_images[cls] = registry.get_image(self.IMAGE)
+    return image
 
   def get_placeholder(self):
     """Generate a placeholder surface"""
@@ -68,9 +100,23 @@ class Object(object):
     py = (SCREEN_HEIGHT / 2) - (self.get_height() / 2) if dims[1] else self.pos[1]
     self.pos = (px, py)
 
+  def get_draw_pos(self, alpha):
+    """Return the position to draw at, alpha of the way between the last
+    two simulation steps. Objects that don't move are drawn where they are"""
+    return self.pos
+
   def tick(self):
-    # Update the stored rect of object given its pos, width and height
-    self.rect = pygame.Rect(self.pos, (self.get_width(), self.get_height()))
+    # Update the stored rect of object given its pos, width and height, in
+    #  place rather than making a new one every step
+    rect = self.rect
+    rect.topleft = self.pos
+    rect.size = (self.get_width(), self.get_height())
+    if self.COLLIDABLE:
+      self.controller.engine.collision_index.update(self)
+
+  def collides(self, rect):
+    """Whether this object overlaps the given rect"""
+    return self.rect.colliderect(rect)
 
   def destroy(self):
     pass
@@ -79,12 +125,39 @@ class MovableObject(Object):
   """An object that moves, has a velocity which updates the position on each
   tick"""
 
+  # Position at the previous simulation step, drawing interpolates from it
+  __slots__ = ('previous_pos',)
+
   velocity = (0, 0)
 
+  def __init__(self, *args, **kwargs):
+    self.previous_pos = None
+    super(MovableObject, self).__init__(*args, **kwargs)
+
   def tick(self):
     super(MovableObject, self).tick()
+    self.previous_pos = self.pos
     self.tick_move()
 
+  def recycle(self, *args, **kwargs):
+    # Don't interpolate from where the object was before it was released
+    self.previous_pos = None
+    super(MovableObject, self).recycle(*args, **kwargs)
+
+  def snap(self):
+    """Jump straight to the current position rather than interpolating to it,
+    for teleports such as wrapping or hopping"""
+    self.previous_pos = self.pos
+
+  def get_draw_pos(self, alpha):
+    """Interpolate between the previous and current position"""
+    if self.previous_pos is None:
+      return self.pos
+    return (
+      self.previous_pos[0] + (self.pos[0] - self.previous_pos[0]) * alpha,
+      self.previous_pos[1] + (self.pos[1] - self.previous_pos[1]) * alpha
+    )
+
   def tick_move(self):
     """Move the object based on velocity"""
     new_pos = (
@@ -97,35 +170,46 @@ class MovableObject(Object):
 class CollisionDetectionMixin(Object):
   """Adds a collision check mechanism"""
 
+  __slots__ = ()
+
   def collision_check(self):
-    for obj in self.controller.engine.objects:
-      if not (obj is self or self.rect.colliderect(obj.rect) == 0):
+    """Return the first collidable object overlapping this one, or False.
+    Only objects sharing this object's rows are checked"""
+    candidates = self.controller.engine.collision_index.query(self.rect)
+    for obj in candidates:
+      if not (obj is self or not obj.collides(self.rect)):
         return obj
     return False
 
 
 class Hut(Object):
   """Huts at top of screen the player reaches to win"""
+  __slots__ = ()
   IMAGE = HUT
   PLACEHOLDER_COLOUR = GREEN
+  COLLIDABLE = True
 
 
 class Egg(Object):
   """Eggs represent lives in the score bar"""
+  __slots__ = ()
   Z_INDEX = 10
   IMAGE = EGG
 
 
 class PopupObject(Object):
   """Base class for popups"""
+  __slots__ = ()
   Z_INDEX = 100
 
 class AliveChickenPopup(PopupObject):
   """Death popup"""
+  __slots__ = ()
   IMAGE = ALIVE_CHICKEN
 
 class DeadChickenPopup(PopupObject):
   """Death popup"""
+  __slots__ = ()
   IMAGE = DEAD_CHICKEN
 
 
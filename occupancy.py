@@ -0,0 +1,189 @@
+from consts import *
+
+# NumPy is optional, without it the grid is built a car at a time
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+ROWS = SCREEN_HEIGHT // GRID
+COLUMNS = SCREEN_WIDTH // GRID
+ALL_COLUMNS = (1 << COLUMNS) - 1
+
+
+class OccupancyGrid(object):
+  """Where the cars of a list of Lanes will be, as a bitset of the columns
+  blocked in each row for each time slot of slot_steps simulation steps from
+  when the lanes were laid out. A column is blocked in a slot if a car
+  overlaps a cell_width wide player in it at any step of the slot, or any
+  of the lag_steps steps before it when collisions are checked against where
+  cars were that many steps ago. Slots are worked out CHUNK at a time, as far
+  ahead as they're asked for"""
+
+  CHUNK = 64
+  # Pixels either side cars are treated as covering, so rounding in when
+  #  the time is read can't let a near miss through
+  MARGIN = 1
+
+  def __init__(self, lanes, step_time, slot_steps, cell_width=GRID,
+      lag_steps=0):
+    self.lanes = lanes
+    self.step_time = step_time
+    self.slot_steps = slot_steps
+    self.lag_steps = lag_steps
+    self.cell_width = cell_width
+    self.origin = lanes[0].start if lanes else 0
+
+    # For each slot worked out, the blocked column bitset of each row
+    self.blocked_slots = []
+
+  def get_slot(self, t):
+    """Return (slot, steps into it) of simulated time t"""
+    step = int(round((t - self.origin) / self.step_time))
+    return divmod(step, self.slot_steps)
+
+  def get_blocked(self, slot):
+    """Return a list of the bitset of columns blocked in each row during a
+    slot"""
+    while slot >= len(self.blocked_slots):
+      self.extend()
+    return self.blocked_slots[slot]
+
+  def extend(self):
+    """Work out the next CHUNK slots"""
+    first = len(self.blocked_slots)
+    chunk = [[0] * ROWS for i in range(self.CHUNK)]
+    for lane in self.lanes:
+      if numpy is not None:
+        masks = self.get_lane_masks(lane, first, self.CHUNK)
+      else:
+        masks = self.get_lane_masks_slow(lane, first, self.CHUNK)
+      row = lane.y // GRID
+      for blocked, mask in zip(chunk, masks):
+        blocked[row] |= mask
+    self.blocked_slots.extend(chunk)
+
+  def get_columns(self, x, width):
+    """Return the first and last columns a car at x overlaps the player in,
+    the car's x truncated to pixels as the collision check does"""
+    left = x - self.MARGIN - self.cell_width
+    right = x + width + self.MARGIN
+    return left // GRID + 1, -(-right // GRID) - 1
+
+  def get_lane_masks(self, lane, first, count):
+    """Return the blocked column bitsets of a lane for count slots"""
+    steps = numpy.arange(
+      first * self.slot_steps - self.lag_steps,
+      (first + count) * self.slot_steps
+    )
+    t = self.origin + steps * self.step_time
+    offsets = numpy.array(lane.offsets, dtype=float)
+
+    # Cars' positions at each step, by step then car, as in Lane.position
+    travelled = lane.velocity * (t - lane.start)
+    x = (offsets + lane.width + travelled[:, None]) % lane.length - lane.width
+    first_column, last_column = self.get_columns(
+      x.astype(numpy.int64), lane.width
+    )
+    first_column = numpy.clip(first_column, 0, COLUMNS)
+    last_column = numpy.clip(last_column, -1, COLUMNS - 1)
+
+    masks = numpy.where(first_column <= last_column,
+      (numpy.int64(1) << (last_column + 1)) - (numpy.int64(1) << first_column),
+      0
+    )
+    # Everything blocked by any car at any step of each slot, or lagging it
+    step_masks = numpy.bitwise_or.reduce(masks, axis=1)
+    masks = numpy.zeros(count, dtype=numpy.int64)
+    for i in range(self.lag_steps + self.slot_steps):
+      masks |= step_masks[i::self.slot_steps][:count]
+    return masks.tolist()
+
+  def get_lane_masks_slow(self, lane, first, count):
+    masks = []
+    for slot in range(first, first + count):
+      mask = 0
+      start = slot * self.slot_steps - self.lag_steps
+      for step in range(start, (slot + 1) * self.slot_steps):
+        for x in lane.positions(self.origin + step * self.step_time):
+          first_column, last_column = self.get_columns(int(x), lane.width)
+          first_column = max(first_column, 0)
+          last_column = min(last_column, COLUMNS - 1)
+          if first_column <= last_column:
+            mask |= (1 << (last_column + 1)) - (1 << first_column)
+      masks.append(mask)
+    return masks
+
+
+class AutoPlayer(object):
+  """Plans the player's hops across the road, one hop or wait per slot of an
+  OccupancyGrid. A breadth first search over the grid, a row of reachable
+  columns at a time as bitsets, finds the fewest slots to a goal column of
+  the goal row without being in a blocked cell"""
+
+  # Hops have to stay between these rows, as PlayerController's bounds
+  TOP_ROW = 1
+  BOTTOM_ROW = ROWS - 2
+
+  # Furthest ahead a plan looks, in slots
+  MAX_SLOTS = 1024
+
+  def plan(self, grid, row, column, slot, goal_columns, goal_row=TOP_ROW):
+    """Return the list of directions (LEFT, UP, RIGHT, DOWN or None to wait)
+    to play from slot onwards, for the player in row and column, to reach
+    any column in the goal_columns bitset of goal_row. None if there's no
+    way there within MAX_SLOTS"""
+    top, bottom = self.TOP_ROW, self.BOTTOM_ROW
+
+    reachable = [0] * ROWS
+    reachable[row] = 1 << column
+    layers = []
+
+    for s in range(slot, slot + self.MAX_SLOTS):
+      blocked = grid.get_blocked(s)
+      # Stay, hop left or right, hop up from below or down from above
+      step = [0] * ROWS
+      for r in range(top, bottom + 1):
+        cells = reachable[r]
+        cells |= (cells << 1) | (cells >> 1)
+        if r < bottom:
+          cells |= reachable[r + 1]
+        if r > top:
+          cells |= reachable[r - 1]
+        step[r] = cells & ALL_COLUMNS & ~blocked[r]
+
+      layers.append(step)
+      reachable = step
+      goal = step[goal_row] & goal_columns
+      if goal:
+        return self.get_path(layers, row, column, goal_row, lowest_bit(goal))
+
+    return None
+
+  def get_path(self, layers, row, column, goal_row, goal_column):
+    """Trace back from the goal to the start through the reachable cells of
+    each layer, returning the directions taken"""
+    directions = []
+    r, c = goal_row, goal_column
+    for i in range(len(layers) - 1, -1, -1):
+      previous = layers[i - 1] if i else None
+      # Where we could have been last slot, and the hop from there to here
+      for direction, pr, pc in (
+        (None, r, c), (UP, r + 1, c), (LEFT, r, c + 1),
+        (RIGHT, r, c - 1), (DOWN, r - 1, c),
+      ):
+        if previous is None:
+          found = (pr, pc) == (row, column)
+        else:
+          found = 0 <= pr < ROWS and pc >= 0 and previous[pr] >> pc & 1
+        if found:
+          directions.append(direction)
+          r, c = pr, pc
+          break
+    directions.reverse()
+    return directions
+
+
+def lowest_bit(bits):
+  """Return the index of the lowest set bit"""
+  return (bits & -bits).bit_length() - 1
@@ -0,0 +1,120 @@
+from timeit import default_timer
+
+from tracing import tracer
+
+class FrameProfiler(object):
+  """Times the phases of each frame, keeping the last HISTORY frames of
+  timings in fixed size ring buffers for rolling percentiles and a frame time
+  histogram. Phases are timed by marking the end of each one, and are also
+  recorded as trace spans while the tracer is running. mark does nothing
+  while the profiler and tracer are both off"""
+
+  HISTORY = 600
+  PERCENTILES = (50, 95, 99)
+  # Upper edges, in ms, of the frame time histogram buckets, the last bucket
+  #  takes everything slower
+  HISTOGRAM_EDGES = (4, 8, 17, 33, 50)
+
+  def __init__(self):
+    self.enabled = False
+    self.reset()
+
+  def reset(self):
+    """Forget all timings"""
+    # Phase -> ring buffer of its time in each frame, in seconds
+    self.phases = {}
+    self.phase_order = []
+    self.frame_times = [0.0] * self.HISTORY
+    self.frames = 0
+    self.current = {}
+    # None outside a timed frame, such as when turned on part way through one
+    self.frame_start = self.last_mark = None
+
+  def enable(self, enabled=True):
+    self.enabled = enabled
+    if enabled:
+      self.reset()
+
+  def is_active(self):
+    """Whether phases are being timed, for the profiler or the tracer"""
+    return self.enabled or tracer.enabled
+
+  def start_frame(self):
+    if not self.is_active(): return
+    self.frame_start = self.last_mark = default_timer()
+    self.current = {}
+
+  def mark(self, phase):
+    """Record the time since the last mark against phase, which can be any
+    hashable such as a name or a class"""
+    if not self.is_active() or self.frame_start is None: return
+    now = default_timer()
+    tracer.complete(self.get_phase_name(phase), self.last_mark, now)
+    if phase not in self.phases:
+      self.phases[phase] = [0.0] * self.HISTORY
+      self.phase_order.append(phase)
+    self.current[phase] = self.current.get(phase, 0.0) + now - self.last_mark
+    self.last_mark = now
+
+  def end_frame(self):
+    if not self.is_active() or self.frame_start is None: return
+    now = default_timer()
+    tracer.complete('frame', self.frame_start, now)
+    slot = self.frames % self.HISTORY
+    self.frame_times[slot] = now - self.frame_start
+
+    for phase, times in self.phases.items():
+      times[slot] = self.current.get(phase, 0.0)
+
+    self.frames += 1
+    self.frame_start = self.last_mark = None
+
+  def get_recorded(self, times):
+    """Return the valid entries of a ring buffer"""
+    return times[:min(self.frames, self.HISTORY)]
+
+  def get_percentiles(self, times):
+    """Return the PERCENTILES of a ring buffer, in ms"""
+    recorded = sorted(self.get_recorded(times))
+    if not recorded:
+      return [0.0] * len(self.PERCENTILES)
+    return [
+      recorded[min(len(recorded) - 1, len(recorded) * p // 100)] * 1000
+      for p in self.PERCENTILES
+    ]
+
+  def get_histogram(self):
+    """Return the count of frames in each HISTOGRAM_EDGES bucket"""
+    counts = [0] * (len(self.HISTOGRAM_EDGES) + 1)
+    for frame_time in self.get_recorded(self.frame_times):
+      ms = frame_time * 1000
+      for i, edge in enumerate(self.HISTOGRAM_EDGES):
+        if ms < edge:
+          counts[i] += 1
+          break
+      else:
+        counts[-1] += 1
+    return counts
+
+  def get_phase_name(self, phase):
+    return getattr(phase, '__name__', phase)
+
+  def get_summary(self):
+    """Return lines of text summarising the recorded frames"""
+    lines = ["{:<22} {:>6} {:>6} {:>6}".format(
+      "ms", *["p{}".format(p) for p in self.PERCENTILES]
+    )]
+    rows = [("frame", self.frame_times)]
+    rows += [(self.get_phase_name(p), self.phases[p]) for p in self.phase_order]
+    for name, times in rows:
+      lines.append("{:<22} {:>6.2f} {:>6.2f} {:>6.2f}".format(
+        name, *self.get_percentiles(times)
+      ))
+
+    edges = ("<{}".format(edge) for edge in self.HISTOGRAM_EDGES)
+    labels = list(edges) + [">{}".format(self.HISTOGRAM_EDGES[-1])]
+    lines.append(" ".join(
+      "{}:{}".format(label, count)
+      for label, count in zip(labels, self.get_histogram())
+    ))
+    return lines
@@ -0,0 +1,282 @@
+import json
+import random
+import struct
+
+import pygame
+from pygame.locals import *
+
+# Recordings are a header followed by a stream of records, each a type byte
+#  then its fields. A frame's input and game event records come before the
+#  FRAMES record ending it, frames with nothing but steps are run length
+#  encoded into a single FRAMES record.
+MAGIC = b'FRGR'
+VERSION = 1
+HEADER = struct.Struct('<4sBQd') # Magic, version, seed, step time in ms
+RECORD_TYPE = struct.Struct('<B')
+FRAMES = struct.Struct('<HB') # Number of frames, steps run each frame
+KEY = struct.Struct('<iHI') # Key, modifiers, unicode code point or 0
+GAME_EVENT = struct.Struct('<iH') # Event code, length of the JSON payload
+
+R_FRAMES = 1
+R_KEYDOWN = 2
+R_QUIT = 3
+R_GAME_EVENT = 4
+R_EXTERNAL_EVENT = 5
+
+MAX_RUN = 0xFFFF
+
+
+class RecordingError(Exception):
+  pass
+
+
+class RecordingWriter(object):
+  """Writes a recording to a file as it happens"""
+
+  def __init__(self, path, seed, step_time):
+    self.file = open(path, 'wb')
+    self.file.write(HEADER.pack(MAGIC, VERSION, seed, step_time))
+    # Frames with no records not yet written, and the steps each ran
+    self.run_length = 0
+    self.run_steps = 0
+
+  def write_record(self, record_type, record, data=b''):
+    self.file.write(RECORD_TYPE.pack(record_type))
+    self.file.write(record)
+    self.file.write(data)
+
+  def write_run(self):
+    while self.run_length:
+      length = min(self.run_length, MAX_RUN)
+      self.write_record(R_FRAMES, FRAMES.pack(length, self.run_steps))
+      self.run_length -= length
+
+  def write_input(self, event):
+    """Write a pygame event the game handles, others are ignored"""
+    self.write_run()
+    if event.type == KEYDOWN:
+      self.write_record(R_KEYDOWN, KEY.pack(
+        event.key, event.mod, ord(event.unicode) if event.unicode else 0
+      ))
+    elif event.type == QUIT:
+      self.write_record(R_QUIT, b'')
+
+  def write_game_event(self, code, payload, external=False):
+    self.write_run()
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    self.write_record(
+      R_EXTERNAL_EVENT if external else R_GAME_EVENT,
+      GAME_EVENT.pack(code, len(data)), data
+    )
+
+  def end_frame(self, steps, empty):
+    """Finish a frame that ran steps steps, empty if nothing else was written
+    for it"""
+    if empty and steps == self.run_steps:
+      self.run_length += 1
+      return
+    self.write_run()
+    if empty:
+      self.run_length, self.run_steps = 1, steps
+    else:
+      self.write_record(R_FRAMES, FRAMES.pack(1, steps))
+
+  def close(self):
+    self.write_run()
+    self.file.close()
+
+
+class Frame(object):
+  """A recorded frame, the input fed before it, game events from outside the
+  simulation to inject, the steps it ran and the game events delivered"""
+
+  def __init__(self):
+    self.inputs = []
+    self.external_events = []
+    self.game_events = []
+    self.steps = 1
+
+
+class RecordingReader(object):
+  """Reads a recording a frame at a time"""
+
+  def __init__(self, path):
+    self.file = open(path, 'rb')
+    magic, version, self.seed, self.step_time = self.read(HEADER)
+    if magic != MAGIC or version != VERSION:
+      raise RecordingError("{} is not a version {} recording".format(
+        path, VERSION
+      ))
+
+  def read(self, record_struct):
+    data = self.file.read(record_struct.size)
+    if len(data) < record_struct.size:
+      raise RecordingError("Recording ends part way through a record")
+    return record_struct.unpack(data)
+
+  def read_game_event(self):
+    code, length = self.read(GAME_EVENT)
+    payload = json.loads(self.file.read(length))
+    # Keyword argument names can't be unicode in python 2
+    return code, dict((str(key), value) for key, value in payload.items())
+
+  def __iter__(self):
+    frame = Frame()
+    while True:
+      data = self.file.read(RECORD_TYPE.size)
+      if not data:
+        break
+      record_type, = RECORD_TYPE.unpack(data)
+
+      if record_type == R_FRAMES:
+        length, frame.steps = self.read(FRAMES)
+        yield frame
+        for i in range(length - 1):
+          empty = Frame()
+          empty.steps = frame.steps
+          yield empty
+        frame = Frame()
+      elif record_type == R_KEYDOWN:
+        key, mod, code_point = self.read(KEY)
+        frame.inputs.append(pygame.event.Event(KEYDOWN,
+          key=key, mod=mod, unicode=unichr(code_point) if code_point else u''
+        ))
+      elif record_type == R_QUIT:
+        frame.inputs.append(pygame.event.Event(QUIT))
+      elif record_type == R_GAME_EVENT:
+        frame.game_events.append(self.read_game_event())
+      elif record_type == R_EXTERNAL_EVENT:
+        frame.external_events.append(self.read_game_event())
+      else:
+        raise RecordingError("Unknown record type {}".format(record_type))
+
+  def close(self):
+    self.file.close()
+
+
+class Recorder(object):
+  """Records a session to a file, so it can be replayed exactly. Attached to
+  an engine as its recorder, before it's first ticked, it reseeds the
+  engine's random and is told its input, game events and frames"""
+
+  def __init__(self, path, seed=None):
+    self.path = path
+    if seed is None:
+      seed = random.SystemRandom().getrandbits(63)
+    self.seed = seed
+    self.writer = None
+    self.engine = None
+    self.empty = True
+
+  def attach(self, engine):
+    self.engine = engine
+    engine.random.seed(self.seed)
+    self.writer = RecordingWriter(self.path, self.seed, engine.step_time)
+    engine.recorder = self
+
+  def on_input(self, events):
+    for event in events:
+      if event.type in (KEYDOWN, QUIT):
+        self.writer.write_input(event)
+        self.empty = False
+
+  def on_game_event(self, event):
+    """Record a game event about to be handled, returning whether it should
+    be handled"""
+    self.writer.write_game_event(event.game_event, event.payload,
+      external=event.game_event in self.engine.EXTERNAL_EVENTS
+    )
+    self.empty = False
+    return True
+
+  def on_frame(self, steps):
+    self.writer.end_frame(steps, self.empty)
+    self.empty = True
+
+  def close(self):
+    if self.engine:
+      self.engine.recorder = None
+    self.writer.close()
+
+
+class Replayer(object):
+  """Plays a recording back through a headless engine as fast as possible,
+  running the same steps each frame with the same input, and checks the game
+  events delivered match the recording. The engine must not have been
+  ticked yet, its random is seeded from the recording.
+
+  Game events from outside the simulation, such as scores saved by another
+  thread, are injected when they were recorded and dropped when they really
+  happen"""
+
+  def __init__(self, path):
+    self.reader = RecordingReader(path)
+    self.engine = None
+    self.delivered = []
+    # External events injected and not yet delivered, by code
+    self.injected = {}
+    # The first frame whose game events didn't match, if any
+    self.diverged_frame = None
+    self.expected_events = None
+
+  def on_input(self, events):
+    pass
+
+  def on_game_event(self, event):
+    code = event.game_event
+    if code in self.engine.EXTERNAL_EVENTS:
+      if not self.injected.get(code):
+        return False
+      self.injected[code] -= 1
+      return True
+
+    self.delivered.append((code, event.payload))
+    return True
+
+  def on_frame(self, steps):
+    pass
+
+  def run(self, engine, frames=None):
+    """Replay into engine, stopping at the end of the recording, if the game
+    events diverge or after frames frames. Returns the number of frames
+    replayed"""
+    if engine.step_time != self.reader.step_time:
+      raise RecordingError("Recorded with a different simulation rate")
+
+    self.engine = engine
+    engine.random.seed(self.reader.seed)
+    engine.recorder = self
+
+    count = 0
+    for frame in self.reader:
+      if frames is not None and count >= frames:
+        break
+
+      for event in frame.inputs:
+        engine.feed_event(event)
+      for code, payload in frame.external_events:
+        self.injected[code] = self.injected.get(code, 0) + 1
+        engine.events.post(code, **payload)
+
+      self.delivered = []
+      engine.frame_steps = frame.steps
+      engine.tick()
+      count += 1
+
+      # Compare payloads as the recording holds them, after a JSON round trip
+      delivered = [
+        (code, json.loads(json.dumps(payload)))
+        for code, payload in self.delivered
+      ]
+      if delivered != frame.game_events:
+        self.diverged_frame = count - 1
+        self.expected_events = frame.game_events
+        break
+
+      if not engine.keep_alive:
+        break
+
+    engine.frame_steps = None
+    engine.recorder = None
+    self.reader.close()
+    return count
@@ -0,0 +1,290 @@
+import os
+import csv
+import sqlite3
+import threading
+import traceback
+from Queue import Queue
+
+class ScoreRanking(object):
+  """Order statistics over integer scores. A Fenwick tree of how many scores
+  fall in each bucket gives O(log n) inserts and rank lookups. The tree is
+  sparse, only the nodes scores have been added under are kept, so its size
+  depends on how many different scores there are rather than the highest"""
+
+  # Buckets the tree covers, higher scores share the last one
+  SIZE = 1 << 31
+
+  def __init__(self, bucket_size=1):
+    self.bucket_size = bucket_size
+    # Node -> its count, missing nodes are 0
+    self.tree = {}
+    self.total = 0
+
+  def get_bucket(self, score):
+    return min(max(0, int(score)) // self.bucket_size, self.SIZE - 1)
+
+  def add(self, score, count=1):
+    """Record count more of a score"""
+    self.total += count
+    tree = self.tree
+    i = self.get_bucket(score) + 1
+    while i <= self.SIZE:
+      tree[i] = tree.get(i, 0) + count
+      i += i & -i
+
+  def count_below(self, bucket):
+    """Return how many scores are in buckets lower than bucket"""
+    i = min(bucket, self.SIZE)
+    tree = self.tree
+    total = 0
+    while i > 0:
+      total += tree.get(i, 0)
+      i -= i & -i
+    return total
+
+  def count_above(self, score):
+    """Return how many scores are in buckets higher than score's"""
+    return self.total - self.count_below(self.get_bucket(score) + 1)
+
+  def rank(self, score):
+    """Return the leaderboard position of a score, equal scores share a
+    rank. 1 is the best"""
+    return self.count_above(score) + 1
+
+  def top_percent(self, score):
+    """Return the percentage of scores at or above score's rank"""
+    if not self.total:
+      return 100.0
+    return 100.0 * min(self.rank(score), self.total) / self.total
+
+
+class ScoreWriter(threading.Thread):
+  """Background thread saving scores, so the game never waits on the disk.
+  Scores queued while a write is in progress are batched into the next
+  transaction. Each transaction is synced to disk before the on_saved
+  callbacks of its scores are called, from this thread. A transaction that
+  fails is logged and the on_failed callbacks of its scores called instead,
+  so the game isn't left waiting on them"""
+
+  QUEUE_SIZE = 256
+  BATCH_SIZE = 64
+
+  def __init__(self, path, on_written=None):
+    super(ScoreWriter, self).__init__(name="ScoreWriter")
+    self.daemon = True
+    self.path = path
+    # Called with the scores of each transaction once it's committed, before
+    #  their callbacks
+    self.on_written = on_written
+    # Items of (name, score, on_saved, on_failed), None to stop
+    self.queue = Queue(self.QUEUE_SIZE)
+
+  def save(self, name, score, on_saved=None, on_failed=None):
+    """Queue a score to save, blocks only if the queue is full"""
+    self.queue.put((name, score, on_saved, on_failed))
+
+  def run(self):
+    # SQLite connections belong to the thread that made them
+    connection = sqlite3.connect(self.path)
+    connection.execute("PRAGMA synchronous = FULL")
+
+    running = True
+    while running:
+      batch = [self.queue.get()]
+      while len(batch) < self.BATCH_SIZE and not self.queue.empty():
+        batch.append(self.queue.get())
+
+      scores = [item for item in batch if item is not None]
+      running = len(scores) == len(batch)
+
+      try:
+        if scores:
+          self.write(connection, scores)
+      finally:
+        for item in batch:
+          self.queue.task_done()
+
+    connection.close()
+
+  def write(self, connection, scores):
+    """Save a batch of (name, score, on_saved, on_failed) in one transaction,
+    then call their on_saved callbacks, or on_failed if it failed"""
+    try:
+      with connection:
+        connection.executemany(
+          "INSERT INTO scores (name, score) VALUES (?, ?)",
+          [item[:2] for item in scores]
+        )
+      saved = True
+    except Exception:
+      print "Failed to save {} scores:".format(len(scores))
+      traceback.print_exc()
+      saved = False
+
+    if saved and self.on_written:
+      self.on_written([score for name, score, on_saved, on_failed in scores])
+
+    for name, score, on_saved, on_failed in scores:
+      callback = on_saved if saved else on_failed
+      if callback:
+        try:
+          callback()
+        except Exception:
+          traceback.print_exc()
+
+  def flush(self):
+    """Wait until everything queued is saved"""
+    self.queue.join()
+
+  def close(self):
+    """Save everything queued then stop the thread"""
+    self.queue.put(None)
+    self.join()
+
+
+class ScoreStore(object):
+  """High scores kept in an SQLite database, indexed by score so the top
+  scores can be read without looking at the rest, however many there are.
+  How many of each score there are is kept up to date by triggers, so the
+  ranking is built from one row per different score rather than every
+  score. Scores from the old CSV file are imported into a new database"""
+
+  def __init__(self, path, csv_path=None):
+    self.path = path
+    self.writer = None
+    # The writer thread adds saved scores to the ranking as ranks are read
+    self.ranking_lock = threading.Lock()
+    self.connection = sqlite3.connect(path)
+    # Write ahead logging lets us read while the writer thread writes
+    self.connection.execute("PRAGMA journal_mode = WAL")
+    self.connection.executescript("""
+      CREATE TABLE IF NOT EXISTS scores (
+        id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL,
+        score INTEGER NOT NULL
+      );
+      CREATE INDEX IF NOT EXISTS scores_by_score ON scores (score DESC, id);
+      CREATE INDEX IF NOT EXISTS scores_by_name ON scores (name, score);
+    """)
+    self.create_score_counts()
+
+    # Built from the score counts, then kept up to date
+    self.ranking = ScoreRanking()
+    for score, count in self.connection.execute(
+      "SELECT score, count FROM score_counts"
+    ):
+      self.ranking.add(score, count)
+
+    if csv_path and os.path.exists(csv_path) and not self.count():
+      self.import_csv(csv_path)
+
+  def create_score_counts(self):
+    """Create the table of how many of each score there are, and the
+    triggers keeping it up to date. Databases from before it existed are
+    counted once, when it's created. It's all one transaction, and the last
+    thing created is what's checked for, so an interrupted migration is
+    redone from scratch"""
+    exists = self.connection.execute(
+      "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?",
+      ('score_counts_delete',)
+    ).fetchone()
+    if exists:
+      return
+
+    # executescript rather than the module's transactions, which commit
+    #  before each CREATE
+    self.connection.executescript("""
+      BEGIN;
+      DROP TRIGGER IF EXISTS score_counts_insert;
+      DROP TABLE IF EXISTS score_counts;
+      CREATE TABLE score_counts (
+        score INTEGER PRIMARY KEY,
+        count INTEGER NOT NULL
+      );
+      INSERT INTO score_counts (score, count)
+        SELECT score, COUNT(*) FROM scores GROUP BY score;
+      CREATE TRIGGER score_counts_insert AFTER INSERT ON scores BEGIN
+        INSERT OR IGNORE INTO score_counts (score, count)
+          VALUES (NEW.score, 0);
+        UPDATE score_counts SET count = count + 1 WHERE score = NEW.score;
+      END;
+      CREATE TRIGGER score_counts_delete AFTER DELETE ON scores BEGIN
+        UPDATE score_counts SET count = count - 1 WHERE score = OLD.score;
+      END;
+      COMMIT;
+    """)
+
+  def import_csv(self, csv_path):
+    """Add the (name, score) rows of a CSV file, skipping malformed rows"""
+    rows = []
+    with open(csv_path, 'rb') as f:
+      for line in csv.reader(f):
+        try:
+          rows.append((line[0].decode('utf-8'), int(line[1])))
+        except (IndexError, ValueError):
+          continue
+    self.add_many(rows)
+
+  def add(self, name, score):
+    """Add a score"""
+    self.add_many([(name, score)])
+
+  def save(self, name, score, on_saved=None, on_failed=None):
+    """Add a score in the background, on_saved is called from the writer
+    thread once it is safely on disk, or on_failed if it couldn't be saved.
+    Ranks include it once it's on disk, before on_saved is called"""
+    if self.writer is None:
+      self.writer = ScoreWriter(self.path, on_written=self.add_to_ranking)
+      self.writer.start()
+    self.writer.save(name, score, on_saved, on_failed)
+
+  def add_to_ranking(self, scores):
+    with self.ranking_lock:
+      for score in scores:
+        self.ranking.add(score)
+
+  def add_many(self, rows):
+    """Add a list of (name, score) in one transaction"""
+    with self.connection:
+      self.connection.executemany(
+        "INSERT INTO scores (name, score) VALUES (?, ?)", rows
+      )
+    self.add_to_ranking([score for name, score in rows])
+
+  def top(self, n):
+    """Return the n highest (name, score), earliest first for equal scores"""
+    return self.connection.execute(
+      "SELECT name, score FROM scores ORDER BY score DESC, id LIMIT ?", (n,)
+    ).fetchall()
+
+  def count(self):
+    """Return the number of scores stored"""
+    return self.ranking.total
+
+  def rank(self, score):
+    """Return the leaderboard position a score has, 1 is the best"""
+    with self.ranking_lock:
+      return self.ranking.rank(score)
+
+  def top_percent(self, score):
+    """Return the percentage of scores a score is in the top of"""
+    with self.ranking_lock:
+      return self.ranking.top_percent(score)
+
+  def personal_best(self, name):
+    """Return a player's highest score, or None if they have none"""
+    return self.connection.execute(
+      "SELECT MAX(score) FROM scores WHERE name = ?", (name,)
+    ).fetchone()[0]
+
+  def flush(self):
+    """Wait for background saves to reach the disk"""
+    if self.writer:
+      self.writer.flush()
+
+  def close(self):
+    """Finish background saves and close the database"""
+    if self.writer:
+      self.writer.close()
+      self.writer = None
+    self.connection.close()
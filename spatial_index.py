@@ -0,0 +1,61 @@
+from consts import *
+
+class RowIndex(object):
+  """Spatial index bucketing objects by the horizontal GRID rows their rect
+  covers. Cars never leave their lane, so an object's rows rarely change and
+  a collision query only has to look at the handful of objects sharing the
+  querying rect's rows"""
+
+  def __init__(self, row_height=GRID):
+    self.row_height = row_height
+    # Row number -> list of objects covering that row
+    self.rows = {}
+    # Object -> (first_row, last_row) it's currently indexed under
+    self.object_rows = {}
+
+  def get_row_span(self, rect):
+    """Return the (first, last) rows covered by a rect"""
+    return (rect.top // self.row_height, (rect.bottom - 1) // self.row_height)
+
+  def update(self, obj):
+    """Index an object under the rows its rect covers, cheap if unchanged"""
+    span = self.get_row_span(obj.rect)
+    old_span = self.object_rows.get(obj)
+    if span == old_span: return
+
+    if old_span:
+      self.remove(obj)
+
+    for row in range(span[0], span[1] + 1):
+      self.rows.setdefault(row, []).append(obj)
+    self.object_rows[obj] = span
+
+  def remove(self, obj):
+    """Remove an object from the index, if it is indexed"""
+    span = self.object_rows.pop(obj, None)
+    if not span: return
+
+    for row in range(span[0], span[1] + 1):
+      row_objects = self.rows[row]
+      row_objects.remove(obj)
+      if not row_objects:
+        del self.rows[row]
+
+  def query(self, rect):
+    """Return the objects indexed in the rows covered by rect. These are only
+    candidates, callers should still check for actual overlap"""
+    first_row, last_row = self.get_row_span(rect)
+    if first_row == last_row:
+      return self.rows.get(first_row, [])
+
+    candidates = []
+    for row in range(first_row, last_row + 1):
+      for obj in self.rows.get(row, []):
+        if obj not in candidates:
+          candidates.append(obj)
+    return candidates
+
+  def clear(self):
+    """Remove all objects from the index"""
+    self.rows = {}
+    self.object_rows = {}
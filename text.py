@@ -3,16 +3,22 @@ from pygame.locals import *
 
 from consts import *
 from objects import Object
+from assets import registry
 
 class TextObject(Object):
   """Object subclass for text"""
+
+  __slots__ = ('font_size', 'font', 'colour', 'text', 'text_surface')
+
   FONT_NAME = FONT_ACTION_MAN
 
   def __init__(self, controller, text="", font_size=32, pos=(0,0), centre=False, colour=YELLOW):
     super(TextObject, self).__init__(controller)
-    # Create font object
-    self.font = pygame.font.Font(self.FONT_NAME, font_size)
+    # Get the shared font object
+    self.font_size = font_size
+    self.font = registry.get_font(self.FONT_NAME, font_size)
     self.colour = colour
+    self.text = None
 
     # Create the text surface
     self.set_text(text)
@@ -26,8 +32,14 @@ class TextObject(Object):
 
   def set_text(self, text):
     """Create and store a surface with the text parameter"""
-    # Create the text surface
-    self.text_surface = self.font.render(unicode(text), True, self.colour)
+    if text == self.text and self.text is not None:
+      # Already showing this text
+      return
+
+    # Get the text surface, rendered text is cached and shared
+    self.text_surface = registry.render_text(
+      self.FONT_NAME, self.font_size, unicode(text), self.colour
+    )
     # Store the text as string for reference
     self.text = text
 
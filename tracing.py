@@ -0,0 +1,113 @@
+import os
+import json
+import threading
+from timeit import default_timer
+from Queue import Queue, Full
+
+class Tracer(object):
+  """Records spans of time as Chrome trace events, written out as JSON by a
+  background thread, for viewing in Perfetto or chrome://tracing. At most
+  MAX_PENDING events wait to be written, any more are dropped and counted
+  rather than letting memory grow"""
+
+  MAX_PENDING = 100000
+
+  def __init__(self):
+    self.enabled = False
+    self.queue = None
+    self.writer = None
+    self.dropped = 0
+    self.origin = default_timer()
+    self.pid = os.getpid()
+
+  def now(self):
+    """Return the time to pass to complete as a span's start"""
+    return default_timer()
+
+  def start(self, path, max_pending=None):
+    """Start recording to a file"""
+    if self.enabled:
+      self.stop()
+
+    self.queue = Queue(max_pending or self.MAX_PENDING)
+    self.dropped = 0
+    self.origin = default_timer()
+    self.writer = threading.Thread(
+      target=self.write, args=(path, self.queue), name="TraceWriter"
+    )
+    self.writer.daemon = True
+    self.writer.start()
+    self.enabled = True
+
+  def record(self, event):
+    try:
+      self.queue.put_nowait(event)
+    except Full:
+      self.dropped += 1
+
+  def complete(self, name, start, end=None, category='engine', args=None):
+    """Record a span from start to end, times as returned by now. end
+    defaults to now"""
+    if not self.enabled: return
+    if end is None:
+      end = default_timer()
+
+    event = {
+      'name': name,
+      'cat': category,
+      'ph': 'X',
+      'ts': (start - self.origin) * 1e6,
+      'dur': (end - start) * 1e6,
+      'pid': self.pid,
+      'tid': threading.current_thread().ident,
+    }
+    if args:
+      event['args'] = args
+    self.record(event)
+
+  def instant(self, name, category='engine', args=None):
+    """Record a moment in time"""
+    if not self.enabled: return
+    event = {
+      'name': name,
+      'cat': category,
+      'ph': 'i',
+      's': 'p',
+      'ts': (default_timer() - self.origin) * 1e6,
+      'pid': self.pid,
+      'tid': threading.current_thread().ident,
+    }
+    if args:
+      event['args'] = args
+    self.record(event)
+
+  def write(self, path, queue):
+    """Writer thread, writes events from the queue until given None"""
+    with open(path, 'w') as f:
+      f.write('[\n')
+      first = True
+      while True:
+        event = queue.get()
+        if event is None:
+          break
+        if not first:
+          f.write(',\n')
+        f.write(json.dumps(event))
+        first = False
+      f.write('\n]\n')
+
+  def stop(self):
+    """Stop recording, waiting for everything recorded to be written"""
+    if not self.enabled: return
+    if self.dropped:
+      self.instant("dropped events", args={'count': self.dropped})
+
+    self.enabled = False
+    # Block for room if need be, the end marker must not be dropped
+    self.queue.put(None)
+    self.writer.join()
+    self.writer = None
+    self.queue = None
+
+# The tracer shared by the whole game, off until started
+tracer = Tracer()